@@ -1,14 +1,22 @@
-import os, json, re
+import os, json, re, hashlib, tempfile
 import nltk
 import numpy as np
 import pandas as pd
+import django
 from sklearn.metrics.pairwise import cosine_similarity
-from gensim import corpora, models
+from gensim import corpora, matutils, models
 from nltk.corpus import stopwords, wordnet
 from nltk.stem import WordNetLemmatizer
 from tqdm import tqdm
 from annoy import AnnoyIndex
-from recommender.models import Movie, MoviePlotRecommendation
+from concurrent.futures import ProcessPoolExecutor
+from .similarity import angular_to_cosine
+
+try:
+    # Optional, considerably faster JSON parser; the standard library is used if it is not installed
+    import orjson
+except ImportError:
+    orjson = None
 
 
 def setup_nltk():
@@ -18,10 +26,13 @@ def setup_nltk():
     nltk.download("stopwords")
     nltk.download("averaged_perceptron_tagger")
 
+PUNCTUATION_RE = re.compile(r"[^\w\s]")
+DIGITS_RE = re.compile(r"\d+")
+
 def clean_text(text: str, stop_words: set) -> str:
     """Clean text by removing punctuation, numbers, and stop words."""
-    text = re.sub(r"[^\w\s]", " ", text.lower())
-    text = re.sub(r"\d+", "", text)
+    text = PUNCTUATION_RE.sub(" ", text.lower())
+    text = DIGITS_RE.sub("", text)
     tokens = [w for w in text.split() if w not in stop_words and len(w) > 2]
     return " ".join(tokens)
 
@@ -39,64 +50,223 @@ def lemma_pos(txt: str, lemmatizer: WordNetLemmatizer) -> str:
     """Lemmatize text using part-of-speech aware lemmatization."""
     return " ".join(lemmatizer.lemmatize(w, get_pos(w)) for w in txt.split())
 
+class LemmaCache:
+    """
+    Memoizes part-of-speech aware lemmatization across documents.
+
+    get_pos tags every word on its own, so a word always gets the same tag and the same
+    lemma; each distinct word is tagged once and each (word, pos) pair lemmatized once.
+    The output is identical to lemma_pos.
+
+    Parameters:
+    lemmatizer (WordNetLemmatizer): The lemmatizer to memoize.
+    max_size (int): Maximum number of entries per table; a full table is emptied and refilled.
+    """
+
+    def __init__(self, lemmatizer: WordNetLemmatizer, max_size=500_000):
+        self.lemmatizer = lemmatizer
+        self.max_size = max_size
+        self.pos_tags = {}
+        self.lemmas = {}
+        self.hits = 0
+        self.misses = 0
+
+    def pos(self, word: str) -> str:
+        pos = self.pos_tags.get(word)
+        if pos is None:
+            if len(self.pos_tags) >= self.max_size:
+                self.pos_tags.clear()
+            pos = self.pos_tags[word] = get_pos(word)
+        return pos
+
+    def lemma(self, word: str) -> str:
+        key = (word, self.pos(word))
+        lemma = self.lemmas.get(key)
+        if lemma is None:
+            self.misses += 1
+            if len(self.lemmas) >= self.max_size:
+                self.lemmas.clear()
+            lemma = self.lemmas[key] = self.lemmatizer.lemmatize(*key)
+        else:
+            self.hits += 1
+        return lemma
+
+    def lemmatize_text(self, txt: str) -> str:
+        """Same as lemma_pos(txt, lemmatizer), using the cached tags and lemmas."""
+        return " ".join(self.lemma(w) for w in txt.split())
 
-def load_movies(data_dir: str):
+
+def init_django_worker(initializer=None, initargs=()):
+    """
+    Process pool initializer that sets up Django before calling initializer(*initargs).
+
+    Forked workers inherit the parent's app registry; spawn/forkserver workers start without one.
+    """
+    django.setup()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def map_chunks(func, items, workers, chunk_size, desc, initializer=None, initargs=()):
+    """
+    Apply func to consecutive chunks of items and concatenate the results in order.
+
+    Parameters:
+    func (callable): Picklable function taking a list of items and returning a list of results.
+    items (list): The work items.
+    workers (int): Number of worker processes. With 1 (or a single chunk) everything runs in this process.
+    chunk_size (int): Number of items per work unit sent to a worker.
+    desc (str): Progress bar description.
+    initializer (callable, optional): Called once in every worker process (and before a serial run).
+    initargs (tuple): Arguments of initializer.
+
+    Returns:
+    list: func's results for every item, in the order of items.
+    """
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    results = []
+    with tqdm(total=len(items), desc=desc) as progress:
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=init_django_worker, initargs=(initializer, initargs)
+            ) as executor:
+                # executor.map yields in submission order, so the merge is deterministic
+                for chunk, chunk_results in zip(chunks, executor.map(func, chunks)):
+                    results.extend(chunk_results)
+                    progress.update(len(chunk))
+        else:
+            if initializer is not None:
+                initializer(*initargs)
+            for chunk in chunks:
+                results.extend(func(chunk))
+                progress.update(len(chunk))
+    return results
+
+def read_movie_file(path: str):
+    """Returns (raw_text, title, movie_id) of a movie information file, or None if it is malformed or incomplete."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            m = orjson.loads(data) if orjson is not None else json.loads(data)
+        except ValueError:
+            # orjson is stricter than json (e.g. NaN), fall back so both paths accept the same files
+            m = json.loads(data)
+        md   = m.get("movielens", {})
+        title = md.get("title", "").strip()
+        plot  = md.get("plotSummary", "").strip()
+        mid   = md.get("movieId")
+        if title and plot and mid is not None:
+            return f"{title.lower()} {plot}", title, mid
+    except Exception:
+        # skip malformed
+        pass
+    return None
+
+def read_movie_files(paths):
+    return [read_movie_file(path) for path in paths]
+
+def load_movies(data_dir: str, workers=1):
     raw_texts, titles, movie_ids = [], [], []
-    files = [f for f in os.listdir(data_dir) if f.endswith(".json")]
+    files = [os.path.join(data_dir, f) for f in os.listdir(data_dir) if f.endswith(".json")]
     
     print(f"Loading {len(files)} movie files...")
-    for fn in tqdm(files, desc="Loading movies"):
-        path = os.path.join(data_dir, fn)
-        try:
-            m = json.load(open(path, "r"))
-            md   = m.get("movielens", {})
-            title = md.get("title", "").strip()
-            plot  = md.get("plotSummary", "").strip()
-            mid   = md.get("movieId")
-            if title and plot and mid is not None:
-                raw_texts.append(f"{title.lower()} {plot}")
-                titles.append(title)
-                movie_ids.append(mid)
-        except Exception:
-            # skip malformed
-            continue
+    for movie in map_chunks(read_movie_files, files, workers, 512, "Loading movies"):
+        if movie is not None:
+            raw_texts.append(movie[0])
+            titles.append(movie[1])
+            movie_ids.append(movie[2])
     return raw_texts, titles, movie_ids
 
-def preprocess(raw_texts, titles, movie_ids, stop_words: set, lemmatizer: WordNetLemmatizer, drop_pct=2):
-    # clean + lemmatize
-    print("Preprocessing text data...")
-    cleaned = []
-    for txt in tqdm(raw_texts, desc="Cleaning and lemmatizing"):
-        cleaned.append(lemma_pos(clean_text(txt, stop_words), lemmatizer))
-    
-    lengths = sorted(len(doc.split()) for doc in cleaned)
-    min_len = int(np.percentile(lengths, drop_pct))
+# Per-process preprocessing state of the clean_docs worker pool
+_worker_state = {}
+
+def init_clean_worker(stop_words: set):
+    _worker_state["stop_words"] = stop_words
+    _worker_state["cache"] = LemmaCache(WordNetLemmatizer())
+
+def clean_chunk(raw_texts):
+    stop_words, cache = _worker_state["stop_words"], _worker_state["cache"]
+    return [cache.lemmatize_text(clean_text(txt, stop_words)) for txt in raw_texts]
+
+def clean_docs(raw_texts, stop_words: set, lemmatizer: WordNetLemmatizer, cache=None, workers=1, chunk_size=256):
+    """
+    Clean and lemmatize every raw text, sharing one LemmaCache across all documents.
+
+    With workers > 1 the texts are processed in chunks by a process pool, each worker keeping its
+    own LemmaCache; the output is identical to the serial run.
+    """
+    if workers > 1:
+        return map_chunks(
+            clean_chunk, raw_texts, workers, chunk_size, "Cleaning and lemmatizing",
+            initializer=init_clean_worker, initargs=(stop_words,)
+        )
+    if cache is None:
+        cache = LemmaCache(lemmatizer)
+    return [cache.lemmatize_text(clean_text(txt, stop_words)) for txt in tqdm(raw_texts, desc="Cleaning and lemmatizing")]
+
+def drop_short_docs(docs, titles, movie_ids, min_len):
+    """Drop documents with fewer than min_len tokens."""
     out_docs, out_titles, out_ids = [], [], []
-    for doc, t, mid in zip(cleaned, titles, movie_ids):
+    for doc, t, mid in zip(docs, titles, movie_ids):
         if len(doc.split()) >= min_len:
             out_docs.append(doc)
             out_titles.append(t)
             out_ids.append(mid)
     return out_docs, out_titles, out_ids
 
+def preprocess(raw_texts, titles, movie_ids, stop_words: set, lemmatizer: WordNetLemmatizer, drop_pct=2, workers=1):
+    # clean + lemmatize
+    print("Preprocessing text data...")
+    cleaned = clean_docs(raw_texts, stop_words, lemmatizer, workers=workers)
+    
+    lengths = sorted(len(doc.split()) for doc in cleaned)
+    min_len = int(np.percentile(lengths, drop_pct))
+    return drop_short_docs(cleaned, titles, movie_ids, min_len)
+
 
-def build_corpus(docs, no_below=20, no_above=0.8, keep_n=5000):
+def build_corpus(docs, no_below=20, no_above=0.8, keep_n=5000, corpus_path=None):
+    """
+    Build the dictionary and bag-of-words corpus of the documents.
+
+    With corpus_path the corpus is serialized to that Matrix Market file and returned as a
+    streamed MmCorpus, so it is never held in memory as Python lists.
+    """
     print("Building corpus...")
     texts = [doc.split() for doc in docs]
     dct   = corpora.Dictionary(texts)
     dct.filter_extremes(no_below=no_below, no_above=no_above, keep_n=keep_n)
-    corpus = [dct.doc2bow(t) for t in tqdm(texts, desc="Creating document-term matrix")]
-    return dct, corpus
+    bows = (dct.doc2bow(t) for t in tqdm(texts, desc="Creating document-term matrix"))
+    if corpus_path is None:
+        return dct, list(bows)
+    corpora.MmCorpus.serialize(corpus_path, bows)
+    return dct, corpora.MmCorpus(corpus_path)
 
-def train_lda(corpus, id2word, num_topics=50, passes=10):
+def train_lda(corpus, id2word, num_topics=50, passes=10, chunksize=100, workers=None):
+    """
+    Train the LDA model. With workers set, gensim's LdaMulticore trains it in that many
+    worker processes; it does not support alpha="auto", so a symmetric prior is used instead.
+    """
     print(f"Training LDA model with {num_topics} topics...")
+    if workers:
+        return models.LdaMulticore(
+            corpus=corpus,
+            id2word=id2word,
+            num_topics=num_topics,
+            random_state=100,
+            chunksize=chunksize,
+            passes=passes,
+            workers=workers,
+            alpha="symmetric",
+            eta="auto"
+        )
     lda = models.LdaModel(
         corpus=corpus,
         id2word=id2word,
         num_topics=num_topics,
         random_state=100,
         update_every=1,
-        chunksize=100,
+        chunksize=chunksize,
         passes=passes,
         alpha="auto",
         eta="auto"
@@ -106,54 +276,217 @@ def train_lda(corpus, id2word, num_topics=50, passes=10):
 def vectorize_docs(lda_model, corpus, num_docs, num_topics):
     print("Vectorizing documents...")
     all_topics = lda_model.get_document_topics(corpus, minimum_probability=0.0)
-    mat = np.zeros((num_docs, num_topics))
-    for i, doc_topics in enumerate(tqdm(all_topics, desc="Creating document vectors")):
-        for tid, prob in doc_topics:
-            mat[i, tid] = prob
-    return mat
+    all_topics = tqdm(all_topics, total=num_docs, desc="Creating document vectors")
+    return matutils.corpus2dense(all_topics, num_terms=num_topics, num_docs=num_docs, dtype=np.float32).T
 
 def build_similarity(lda_vectors):
     print("Computing similarity matrix...")
     sim = cosine_similarity(lda_vectors, lda_vectors)
     return sim
 
-def get_plot_based_recommendation(movie_id: int, recommendation_amount: int):
+# Bump whenever clean_text/lemma_pos change their output, so persisted artefacts are rebuilt
+PREPROCESS_VERSION = 1
+
+ARTIFACT_FILES = {
+    "manifest": "manifest.json",
+    "dictionary": "dictionary.gensim",
+    "model": "lda.model",
+    "movie_ids": "movie_ids.npy",
+    "vectors": "topic_vectors.npy",
+    "index": "annoy.ann",
+}
+
+def text_hash(text: str) -> str:
+    """Returns the sha1 hex digest of a movie's raw text."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def compute_fingerprint(text_hashes: dict, params: dict) -> str:
     """
-    Returns the top‐N movie IDs by LDA‐plot similarity, as stored in the database.
+    Returns a fingerprint of the LDA inputs: every movie's raw text hash plus the training parameters.
     """
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8"))
+    for mid in sorted(text_hashes):
+        digest.update(f"{mid}:{text_hashes[mid]};".encode("utf-8"))
+    return digest.hexdigest()
+
+def load_manifest(artifact_dir: str):
+    """Returns the manifest of the persisted LDA artefacts, or None if they are missing or incomplete."""
+    if not all(os.path.exists(os.path.join(artifact_dir, fn)) for fn in ARTIFACT_FILES.values()):
+        return None
     try:
-        movie = Movie.objects.get(movie_id=movie_id)
-        plot_rec = MoviePlotRecommendation.objects.get(movie=movie)
-        return plot_rec.recommended_movies[:recommendation_amount]
-    except (Movie.DoesNotExist, MoviePlotRecommendation.DoesNotExist):
-        return []
+        with open(os.path.join(artifact_dir, ARTIFACT_FILES["manifest"]), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def build_annoy_index(vectors, num_trees=50):
+    index = AnnoyIndex(vectors.shape[1], 'angular')
+    for i, vec in enumerate(vectors):
+        index.add_item(i, vec)
+    index.build(num_trees)
+    return index
 
 # --- The following class is for offline precomputation only (management command use) ---
 class LdaData:
-    def __init__(self, data_dir, num_topics=50, passes=10):
+    """
+    Trains (or reloads) the LDA model and indexes the topic vector of every movie.
+
+    Parameters:
+    data_dir (str): Directory of the movie information JSON files.
+    num_topics (int): Number of LDA topics.
+    passes (int): Number of training passes over the corpus.
+    artifact_dir (str, optional): Directory the dictionary, model, topic vectors and Annoy index are
+        saved to and reused from. Without it the model is trained from scratch and nothing is saved.
+    retrain (bool): Ignore persisted artefacts and train a new model.
+    workers (int): Number of processes used to load and preprocess the movie files.
+    chunksize (int): Number of documents per LDA training chunk.
+    multicore (bool): Train with gensim's LdaMulticore using workers processes.
+
+    Notes:
+    If the content fingerprint of the inputs matches the persisted one, everything is loaded from disk.
+    If only some movies were added or changed, their topic vectors are inferred with the persisted
+    model and dictionary; the model is only retrained when the parameters differ or retrain is set.
+    """
+
+    def __init__(
+        self, data_dir, num_topics=50, passes=10, artifact_dir=None, retrain=False, workers=1,
+        chunksize=100, multicore=False
+    ):
         print("Initializing LDA-based recommendation system for offline computation...")
-        setup_nltk()
-        self.stop_words = set(stopwords.words("english"))
-        self.lemmatizer = WordNetLemmatizer()
-        raw_texts, self.titles, self.movie_ids = load_movies(data_dir)
-        docs, self.titles, self.movie_ids = preprocess(
-            raw_texts, self.titles, self.movie_ids, self.stop_words, self.lemmatizer
-        )
-        self.dictionary, corpus = build_corpus(docs)
-        self.lda_model = train_lda(corpus, self.dictionary, num_topics=num_topics, passes=passes)
-        lda_vecs = vectorize_docs(self.lda_model, corpus, len(self.titles), self.lda_model.num_topics)
-        self.annoy_index = AnnoyIndex(lda_vecs.shape[1], 'angular')
-        for i, vec in enumerate(lda_vecs):
-            self.annoy_index.add_item(i, vec)
-        self.annoy_index.build(50)
+        self.artifact_dir = artifact_dir
+        self.stop_words = None
+        self.lemmatizer = None
+        self.workers = workers
+        raw_texts, self.titles, self.movie_ids = load_movies(data_dir, workers=workers)
+        text_hashes = {mid: text_hash(txt) for mid, txt in zip(self.movie_ids, raw_texts)}
+        params = {
+            "num_topics": num_topics,
+            "passes": passes,
+            "chunksize": chunksize,
+            "multicore": multicore,
+            "preprocess_version": PREPROCESS_VERSION,
+        }
+        fingerprint = compute_fingerprint(text_hashes, params)
+
+        manifest = load_manifest(artifact_dir) if artifact_dir and not retrain else None
+        if manifest is not None and manifest.get("params") != params:
+            print("LDA parameters changed, retraining...")
+            manifest = None
+
+        if manifest is None:
+            self.status = "trained"
+            self._train(raw_texts, num_topics, passes, chunksize, multicore)
+        elif manifest["fingerprint"] == fingerprint:
+            self.status = "reused"
+            self._load_artifacts(manifest)
+        else:
+            self.status = "updated"
+            self._update(manifest, raw_texts, text_hashes)
+
         self.movie_id_to_index = {mid: idx for idx, mid in enumerate(self.movie_ids)}
+        if artifact_dir and self.status != "reused":
+            self._save_artifacts(text_hashes, fingerprint, params)
         print("LDA-based recommendation system ready for offline computation!")
 
-    def get_recommendations(self, movie_id, top_k):
+    def _setup_preprocessing(self):
+        if self.lemmatizer is None:
+            setup_nltk()
+            self.stop_words = set(stopwords.words("english"))
+            self.lemmatizer = WordNetLemmatizer()
+
+    def _train(self, raw_texts, num_topics, passes, chunksize, multicore):
+        self._setup_preprocessing()
+        docs, self.titles, self.movie_ids = preprocess(
+            raw_texts, self.titles, self.movie_ids, self.stop_words, self.lemmatizer, workers=self.workers
+        )
+        self.min_len = min((len(doc.split()) for doc in docs), default=0)
+        # The corpus is streamed from disk during training and vectorization
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.dictionary, corpus = build_corpus(docs, corpus_path=os.path.join(tmp_dir, "corpus.mm"))
+            self.lda_model = train_lda(
+                corpus, self.dictionary, num_topics=num_topics, passes=passes, chunksize=chunksize,
+                workers=self.workers if multicore else None
+            )
+            self.topic_vectors = vectorize_docs(self.lda_model, corpus, len(self.titles), self.lda_model.num_topics)
+        self.annoy_index = build_annoy_index(self.topic_vectors)
+
+    def _load_artifacts(self, manifest, load_index=True):
+        print(f"Loading LDA artefacts from {self.artifact_dir}...")
+        path = lambda key: os.path.join(self.artifact_dir, ARTIFACT_FILES[key])
+        self.min_len = manifest["min_len"]
+        self.dictionary = corpora.Dictionary.load(path("dictionary"))
+        self.lda_model = models.LdaModel.load(path("model"))
+        self.movie_ids = np.load(path("movie_ids")).tolist()
+        self.topic_vectors = np.load(path("vectors"))
+        self.titles = None
+        if load_index:
+            self.annoy_index = AnnoyIndex(self.topic_vectors.shape[1], 'angular')
+            self.annoy_index.load(path("index"))
+
+    def _update(self, manifest, raw_texts, text_hashes):
+        # Movies whose text is unchanged keep their persisted vector, the others are inferred
+        current_ids = self.movie_ids
+        self._load_artifacts(manifest, load_index=False)
+        old_hashes = manifest["text_hashes"]
+        old_index = {mid: i for i, mid in enumerate(self.movie_ids)}
+        new_texts, new_ids = [], []
+        for txt, mid in zip(raw_texts, current_ids):
+            if old_hashes.get(str(mid)) != text_hashes[mid]:
+                new_texts.append(txt)
+                new_ids.append(mid)
+        print(f"Inferring topic vectors for {len(new_ids)} new or changed movies...")
+
+        new_vectors = {}
+        if new_texts:
+            self._setup_preprocessing()
+            cleaned = clean_docs(new_texts, self.stop_words, self.lemmatizer, workers=self.workers)
+            docs, _, kept_ids = drop_short_docs(cleaned, new_ids, new_ids, self.min_len)
+            corpus = [self.dictionary.doc2bow(doc.split()) for doc in docs]
+            vectors = vectorize_docs(self.lda_model, corpus, len(docs), self.lda_model.num_topics)
+            new_vectors = dict(zip(kept_ids, vectors))
+
+        changed = set(new_ids)
+        movie_ids, rows = [], []
+        for mid in text_hashes:
+            if mid in new_vectors:
+                movie_ids.append(mid)
+                rows.append(new_vectors[mid])
+            elif mid in old_index and mid not in changed:
+                movie_ids.append(mid)
+                rows.append(self.topic_vectors[old_index[mid]])
+        self.movie_ids = movie_ids
+        self.topic_vectors = np.array(rows, dtype=np.float32).reshape(len(rows), self.lda_model.num_topics)
+        self.annoy_index = build_annoy_index(self.topic_vectors)
+
+    def _save_artifacts(self, text_hashes, fingerprint, params):
+        print(f"Saving LDA artefacts to {self.artifact_dir}...")
+        os.makedirs(self.artifact_dir, exist_ok=True)
+        path = lambda key: os.path.join(self.artifact_dir, ARTIFACT_FILES[key])
+        # The manifest is removed first and written last, so an interrupted save is never reused
+        if os.path.exists(path("manifest")):
+            os.remove(path("manifest"))
+        self.dictionary.save(path("dictionary"))
+        self.lda_model.save(path("model"))
+        np.save(path("movie_ids"), np.asarray(self.movie_ids, dtype=np.int64))
+        np.save(path("vectors"), self.topic_vectors)
+        self.annoy_index.save(path("index"))
+        manifest = {
+            "fingerprint": fingerprint,
+            "params": params,
+            "min_len": self.min_len,
+            "text_hashes": {str(mid): h for mid, h in text_hashes.items()},
+        }
+        with open(path("manifest"), "w") as f:
+            json.dump(manifest, f)
+
+    def get_recommendations(self, movie_id, top_k, with_scores=False):
         if movie_id not in self.movie_id_to_index:
-            return []
+            return ([], []) if with_scores else []
         idx = self.movie_id_to_index[movie_id]
         # Get top_k+1 because the first result is the movie itself
-        top_indices = self.annoy_index.get_nns_by_item(idx, top_k + 1)[1:top_k+1]
-        return [self.movie_ids[i] for i in top_indices]
+        top_indices, distances = self.annoy_index.get_nns_by_item(idx, top_k + 1, include_distances=True)
+        recommendations = [self.movie_ids[i] for i in top_indices[1:top_k+1]]
+        if with_scores:
+            return recommendations, angular_to_cosine(distances[1:top_k+1]).tolist()
+        return recommendations
 
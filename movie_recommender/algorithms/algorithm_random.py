@@ -1,9 +1,36 @@
-import random
+import numpy as np
 from recommender.models import Movie
+from .recommendation_cache import MOVIES_GENERATION, get_generation
 
-def get_random_based_recommendation(recommendation_amount):
-    all_ids = list(Movie.objects.values_list('movie_id', flat=True))
-    if len(all_ids) < recommendation_amount:
-        return all_ids
+_movie_ids = None
+_movie_ids_generation = None
 
-    return random.sample(all_ids, recommendation_amount)
\ No newline at end of file
+def get_movie_id_array():
+    """
+    Returns all movie IDs as a compact int32 array, cached per process and reloaded
+    whenever import_movies bumps the movies generation.
+    """
+    global _movie_ids, _movie_ids_generation
+    generation = get_generation(MOVIES_GENERATION)
+    if _movie_ids is None or generation != _movie_ids_generation:
+        _movie_ids = np.fromiter(Movie.objects.values_list('movie_id', flat=True), dtype=np.int32)
+        _movie_ids_generation = generation
+    return _movie_ids
+
+def get_random_based_recommendation(recommendation_amount, movie_id=None, seed=None):
+    """
+    Returns randomly sampled movie IDs, excluding the reference movie.
+
+    Parameters:
+    recommendation_amount (int): The number of movie recommendations to return.
+    movie_id (int, optional): The MovieLens ID of the reference movie, never recommended.
+    seed (int, optional): Seed (e.g. the detail page's ?seed= parameter) that makes the sample for a movie reproducible.
+
+    Returns:
+    list: Up to recommendation_amount random movie IDs.
+    """
+    all_ids = get_movie_id_array()
+    rng = np.random.default_rng(None if seed is None else [seed, movie_id or 0])
+    sample_size = min(recommendation_amount + 1, len(all_ids))
+    sample = all_ids[rng.choice(len(all_ids), size=sample_size, replace=False)]
+    return [int(mid) for mid in sample if mid != movie_id][:recommendation_amount]
@@ -2,7 +2,7 @@ import pandas as pd
 import os
 from pathlib import Path
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from .similarity import top_k_cosine_neighbors
 
 
 def load_tag_matrix(data_dir):
@@ -25,7 +25,8 @@ def load_tag_matrix(data_dir):
         raise FileNotFoundError(f"genome-scores.csv not found in {data_dir}")
 
     try:
-        tag_df = pd.read_csv(genome_scores_path)
+        tag_df = pd.read_csv(genome_scores_path,
+                             dtype={"movieId": np.int32, "tagId": np.int32, "relevance": np.float32})
         tag_matrix = tag_df.pivot(index="movieId",
                                 columns="tagId", 
                                 values="relevance").fillna(0)
@@ -40,18 +41,30 @@ def load_tag_matrix(data_dir):
         raise Exception(f"Unexpected error loading genome-scores.csv: {str(e)}")
 
 
+# --- The following class is for offline precomputation only (management command use) ---
 class TagRecommender:
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, top_k=50, block_size=1024, movie_ids=None):
         """
-        Initialize the recommender system by loading and precomputing similarities.
-        
+        Initialize the recommender system by loading the tag genome and precomputing the top-k neighbours.
+
+        Only the top_k most similar movies are kept per movie, stored as compact int32/float32 arrays,
+        so memory grows with N·k instead of N².
+
         Parameters:
         data_dir (Path): Path to the data directory containing the MovieLens dataset
+        top_k (int): Number of neighbours to keep per movie
+        block_size (int): Number of movies whose similarities are computed at once
+        movie_ids (iterable, optional): Restrict the genome to these MovieLens IDs (e.g. movies present in the database)
         """
-        self.tag_matrix = load_tag_matrix(data_dir)
-        print("Computing similarity matrix by tag for all movies...")
-        self.similarity_matrix = cosine_similarity(self.tag_matrix)
-        self.movie_ids = self.tag_matrix.index.tolist()
+        tag_matrix = load_tag_matrix(data_dir)
+        if movie_ids is not None:
+            tag_matrix = tag_matrix[tag_matrix.index.isin(list(movie_ids))]
+        self.movie_ids = tag_matrix.index.to_numpy(dtype=np.int32)
+        self.movie_id_to_index = {int(mid): idx for idx, mid in enumerate(self.movie_ids)}
+        print(f"Computing top-{top_k} tag neighbours for all movies...")
+        self.neighbor_indices, self.neighbor_scores = top_k_cosine_neighbors(
+            tag_matrix.to_numpy(dtype=np.float32), top_k, block_size=block_size
+        )
         print("Recommender system based on tag is ready!")
 
     def get_recommendations(self, movie_id, recommendation_amount):
@@ -65,33 +78,9 @@ class TagRecommender:
         Returns:
         list: MovieIds of the most similar movies to the input movie based on tag similarity
         """
-        try:
-            movie_idx = self.movie_ids.index(movie_id)
-            similarities = self.similarity_matrix[movie_idx]
-            top_indices = np.argsort(similarities)[::-1][1:recommendation_amount+1]
-            recommendations = [self.movie_ids[idx] for idx in top_indices]
-            
-            return recommendations
-            
-        except ValueError:
+        movie_idx = self.movie_id_to_index.get(movie_id)
+        if movie_idx is None:
             raise ValueError(f"Movie ID {movie_id} not found in the dataset")
-class TagData:
-    _instance = None
-
-    def __new__(cls, data_dir):
-        if cls._instance is None:
-
-            cls._instance = super().__new__(cls)
-            cls._instance.recommender = TagRecommender(data_dir)
-        return cls._instance
-this_dir=os.path.dirname(__file__)
-data_dir=os.path.abspath(os.path.join(this_dir, "..", "datasets", "ml-20m"))
-tag_data = TagData(data_dir)
-
-
-def get_tag_based_recommendation(movie_id, recommendation_amount):
-    """
-    Get movie recommendations using precomputed tag similarities.
-    """
 
-    return tag_data.recommender.get_recommendations(movie_id, recommendation_amount)
+        top_indices = self.neighbor_indices[movie_idx][:recommendation_amount]
+        return self.movie_ids[top_indices].tolist()
@@ -0,0 +1,50 @@
+import json
+import os
+from django.conf import settings
+
+
+def get_changeset_path():
+    return settings.IMPORT_CHANGESET_PATH
+
+
+def write_changeset(added, updated, removed):
+    """
+    Records the movie IDs changed by the last import_movies run.
+
+    Parameters:
+    added (iterable): IDs of movies that did not exist before the import.
+    updated (iterable): IDs of existing movies whose information file or poster changed.
+    removed (iterable): IDs of movies deleted because no information file describes them anymore.
+
+    Returns:
+    dict: The written changeset.
+    """
+    changeset = {
+        "added": sorted(int(mid) for mid in added),
+        "updated": sorted(int(mid) for mid in updated),
+        "removed": sorted(int(mid) for mid in removed),
+    }
+    path = get_changeset_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(changeset, f)
+    os.replace(tmp_path, path)
+    return changeset
+
+
+def load_changeset():
+    """
+    Returns the changeset of the last import_movies run, or None if none was recorded
+    (downstream commands should then assume everything changed).
+    """
+    try:
+        with open(get_changeset_path(), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_unchanged(changeset):
+    """True if the changeset is known and records no added, updated or removed movies."""
+    return changeset is not None and not any(changeset.get(key) for key in ("added", "updated", "removed"))
@@ -0,0 +1,28 @@
+from recommender.models import Movie, MoviePlotRecommendation, MovieTagRecommendation
+
+# Database-only lookups of strategies whose build modules pull in heavy dependencies
+# (gensim, nltk and sklearn for plots, pandas for tags). The web process only imports this module.
+
+
+def get_plot_based_recommendation(movie_id: int, recommendation_amount: int):
+    """
+    Returns the top‐N movie IDs by LDA‐plot similarity, as stored in the database.
+    """
+    try:
+        movie = Movie.objects.get(movie_id=movie_id)
+        plot_rec = MoviePlotRecommendation.objects.get(movie=movie)
+        return plot_rec.recommended_movies[:recommendation_amount]
+    except (Movie.DoesNotExist, MoviePlotRecommendation.DoesNotExist):
+        return []
+
+
+def get_tag_based_recommendation(movie_id, recommendation_amount):
+    """
+    Get movie recommendations using precomputed tag similarities, as stored in the database.
+    """
+    try:
+        recommendations = MovieTagRecommendation.objects.get(movie_id=movie_id)
+        return recommendations.recommended_movies[:recommendation_amount]
+    except MovieTagRecommendation.DoesNotExist:
+        print(f"[WARN] No recommendations found for movie_id {movie_id}")
+        return []
@@ -1,18 +1,87 @@
-from .algorithm_collaborators import get_collaborators_recommendations
-from .algorithm_genre import get_genre_recommendations
-from .algorithm_random import get_random_based_recommendation
-from .algorithm_image import get_image_based_recommendation
-from .algorithm_tag    import get_tag_based_recommendation
-from .algorithm_plot_topic import get_plot_based_recommendation
-
-def get_recommendation(movie_id, recommendation_amount, function_id):
+import importlib
+import time
+from collections import namedtuple
+from recommender.models import Movie
+from .neighbor_store import open_neighbor_store
+from .recommendation_cache import get_cached_recommendation, set_cached_recommendation
+
+# lookup is the ORM path from Movie to the precomputed recommendation list (None if computed on request).
+Strategy = namedtuple("Strategy", ["name", "module", "function", "lookup"])
+
+# Strategy modules are only imported the first time they are used, so that heavy
+# dependencies (pandas, gensim, nltk, annoy, ...) do not slow down worker startup.
+STRATEGIES = {
+    1: Strategy("random", "algorithm_random", "get_random_based_recommendation", None),
+    2: Strategy("image", "algorithm_image", "get_image_based_recommendation",
+                "image_recommendations__recommended_movies"),
+    3: Strategy("genre", "algorithm_genre", "get_genre_recommendations",
+                "genre_recommendations__recommended_movies"),
+    4: Strategy("collaborators", "algorithm_collaborators", "get_collaborators_recommendations",
+                "collaboratour_recommendations__recommended_movies"),
+    5: Strategy("plot", "lookups", "get_plot_based_recommendation",
+                "plot_recommendations__recommended_movies"),
+    6: Strategy("tag", "lookups", "get_tag_based_recommendation",
+                "tag_recommendations__recommended_movies"),
+}
+
+# Strategies with stored recommendation lists, by name (used by the JSON API)
+PRECOMPUTED_STRATEGIES = {strategy.name: function_id for function_id, strategy in STRATEGIES.items() if strategy.lookup}
+
+_resolved_strategies = {}
+_import_times = {}
+
+def resolve_strategy(function_id):
+    """
+    Returns the recommendation function of a strategy, importing its module on first use.
+
+    Parameters:
+    function_id (int): The ID of one of the registered recommendation strategies.
+
+    Returns:
+    callable: The strategy's recommendation function.
+    """
+    func = _resolved_strategies.get(function_id)
+    if func is None:
+        strategy = STRATEGIES[function_id]
+        start = time.perf_counter()
+        module = importlib.import_module(f".{strategy.module}", __package__)
+        _import_times.setdefault(strategy.module, time.perf_counter() - start)
+        func = getattr(module, strategy.function)
+        _resolved_strategies[function_id] = func
+    return func
+
+def get_import_report(load_all=False):
+    """
+    Reports how long each strategy module took to import.
+
+    Parameters:
+    load_all (bool): Import every strategy that has not been used yet before reporting.
+
+    Returns:
+    list: (function_id, strategy name, module, seconds) tuples. seconds is None for modules not imported yet.
+
+    Notes:
+
+    Modules are timed in registry order, so dependencies shared between strategies (numpy, Django models, ...)
+    are attributed to the first strategy that imports them.
+    """
+    if load_all:
+        for function_id in STRATEGIES:
+            resolve_strategy(function_id)
+    return [
+        (function_id, strategy.name, strategy.module, _import_times.get(strategy.module))
+        for function_id, strategy in STRATEGIES.items()
+    ]
+
+def get_recommendation(movie_id, recommendation_amount, function_id, seed=None):
     """
     Dispatches a movie recommendation request to one of several recommendation strategies.
 
     Parameters:
     movie_id (int): The MovieLens ID of the reference movie.
     recommendation_amount (int): The number of movie recommendations to return.
-    function_id (int): The ID representing one of the implemented recommendation strategies (1-5).
+    function_id (int): The ID representing one of the implemented recommendation strategies (1-6).
+    seed (int, optional): Seed for the random strategy, making its result reproducible.
 
     Returns:
     list: A list of recommended movie IDs based on the selected recommendation strategy.
@@ -28,24 +97,106 @@ def get_recommendation(movie_id, recommendation_amount, function_id):
 
     match function_id:
         case 1:
-            return get_random_based_recommendation(recommendation_amount)
-        case 2:
-            return get_image_based_recommendation(movie_id, recommendation_amount)
-        case 3:
-            return get_genre_recommendations(movie_id, recommendation_amount)
-        case 4:
-            return get_collaborators_recommendations(movie_id, recommendation_amount)
-        case 5:
-            return get_plot_based_recommendation(movie_id, recommendation_amount)
-        case 6:
-            try:
-                return get_tag_based_recommendation(movie_id, recommendation_amount)
-            except Exception as e:
-                print(f"Tag based recommendation failed with error: {e}")
-                return recommendation_placeholder(movie_id, recommendation_amount)
+            return resolve_strategy(1)(recommendation_amount, movie_id, seed)
+        case 2 | 3 | 4 | 5 | 6:
+            name = STRATEGIES[function_id].name
+            recommendations = get_cached_recommendation(name, movie_id, recommendation_amount)
+            if recommendations is None:
+                store = open_neighbor_store(name)
+                if store is not None:
+                    recommendations = store.get(movie_id, recommendation_amount)
+                else:
+                    recommendations = resolve_strategy(function_id)(movie_id, recommendation_amount)
+                set_cached_recommendation(name, movie_id, recommendation_amount, recommendations)
+            return list(recommendations)
         case _:
             return recommendation_placeholder(movie_id, recommendation_amount)
     
+def fetch_precomputed_recommendations(movie_ids, function_ids):
+    """
+    Fetches the stored recommendation lists of several movies and strategies.
+
+    Strategies with a neighbour store are read from its memory-mapped file; all the others are
+    read from their database tables in a single query, dropping movies that no longer exist.
+
+    Parameters:
+    movie_ids (iterable): MovieLens IDs of the reference movies.
+    function_ids (iterable): IDs of precomputed strategies (strategies without a lookup are ignored).
+
+    Returns:
+    dict: {movie_id: {function_id: list of recommended movie IDs}}. Missing lists are empty.
+    """
+    lookups = {function_id: STRATEGIES[function_id].lookup for function_id in function_ids
+               if STRATEGIES[function_id].lookup}
+    results = {movie_id: {function_id: [] for function_id in lookups} for movie_id in movie_ids}
+
+    for function_id in list(lookups):
+        store = open_neighbor_store(STRATEGIES[function_id].name)
+        if store is not None:
+            for movie_id, recommendations in results.items():
+                recommendations[function_id] = store.get(movie_id)
+            del lookups[function_id]
+
+    if not lookups or not results:
+        return results
+
+    rows = list(Movie.objects.filter(movie_id__in=list(results)).values("movie_id", *lookups.values()))
+    # Stored lists are only rewritten by the next build, so they may still name movies removed since
+    listed = {mid for row in rows for lookup in lookups.values() for mid in row[lookup] or []}
+    existing = set(Movie.objects.filter(movie_id__in=listed).values_list("movie_id", flat=True)) if listed else set()
+    for row in rows:
+        recommendations = results[row["movie_id"]]
+        for function_id, lookup in lookups.items():
+            if row[lookup] and not recommendations[function_id]:
+                recommendations[function_id] = [mid for mid in row[lookup] if mid in existing]
+    return results
+
+def get_all_recommendations(movie_id, recommendation_amount, function_ids=None, seed=None):
+    """
+    Returns the recommended Movie objects of several strategies for one reference movie.
+
+    Parameters:
+    movie_id (int): The MovieLens ID of the reference movie.
+    recommendation_amount (int): The number of movie recommendations to return per strategy.
+    function_ids (iterable, optional): IDs of the strategies to use. Defaults to all registered strategies.
+    seed (int, optional): Seed for the random strategy, making its result reproducible.
+
+    Returns:
+    dict: {function_id: list of Movie objects in rank order}.
+
+    Notes:
+
+    Lists are served from the recommendation cache when possible. The remaining precomputed lists are
+    read in one query and every recommended movie is resolved with a single in_bulk call, instead of
+    two queries per strategy.
+    """
+    if function_ids is None:
+        function_ids = list(STRATEGIES)
+
+    recommended_ids = {}
+    for function_id in function_ids:
+        strategy = STRATEGIES[function_id]
+        if strategy.lookup is None:
+            recommended_ids[function_id] = get_recommendation(movie_id, recommendation_amount, function_id, seed)
+            continue
+        cached = get_cached_recommendation(strategy.name, movie_id, recommendation_amount)
+        if cached is not None:
+            recommended_ids[function_id] = cached
+
+    missing = [function_id for function_id in function_ids if function_id not in recommended_ids]
+    if missing:
+        fetched = fetch_precomputed_recommendations([movie_id], missing)[movie_id]
+        for function_id, ids in fetched.items():
+            recommended_ids[function_id] = ids[:recommendation_amount]
+            set_cached_recommendation(STRATEGIES[function_id].name, movie_id, recommendation_amount,
+                                      recommended_ids[function_id])
+
+    movies = Movie.objects.in_bulk({mid for ids in recommended_ids.values() for mid in ids})
+    return {
+        function_id: [movies[mid] for mid in recommended_ids[function_id] if mid in movies]
+        for function_id in function_ids
+    }
+
 def recommendation_placeholder(movie_id, recommendation_amount): 
     """
     Placeholder recommendation function used during development.
@@ -0,0 +1,181 @@
+import os
+import numpy as np
+from django.conf import settings
+
+# File layout (little-endian):
+#   header    - magic, format version, number of movies N, neighbours per movie K
+#   movie_ids - int32[N], sorted, the row index of every movie (looked up with a binary search)
+#   neighbors - int32[N, K], recommended movie IDs in rank order, padded with -1
+#   scores    - float32[N, K], similarity of each neighbour, padded with NaN
+MAGIC = b"NBRSTORE"
+VERSION = 1
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("num_movies", "<u4"),
+    ("width", "<u4"),
+    ("reserved", "<u4"),
+])
+
+_open_stores = {}
+
+
+def get_store_path(strategy):
+    return os.path.join(settings.NEIGHBOR_STORE_DIR, f"{strategy}.nbr")
+
+
+class NeighborStore:
+    """
+    Read-only view of a neighbour store file.
+
+    The arrays are opened with np.memmap, so every worker process shares the same
+    page cache instead of holding its own copy of the recommendations.
+    """
+
+    def __init__(self, path):
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if len(header) != 1 or header[0]["magic"] != MAGIC or header[0]["version"] != VERSION:
+            raise ValueError(f"{path} is not a neighbour store (version {VERSION})")
+
+        num_movies, width = int(header[0]["num_movies"]), int(header[0]["width"])
+        self.path = path
+        self.width = width
+        if num_movies == 0:
+            self.movie_ids = np.empty(0, dtype="<i4")
+            self.neighbors = np.empty((0, width), dtype="<i4")
+            self.scores = np.empty((0, width), dtype="<f4")
+            return
+
+        offset = HEADER_DTYPE.itemsize
+        self.movie_ids = np.memmap(path, dtype="<i4", mode="r", offset=offset, shape=(num_movies,))
+        offset += self.movie_ids.nbytes
+        self.neighbors = np.memmap(path, dtype="<i4", mode="r", offset=offset, shape=(num_movies, width))
+        offset += self.neighbors.nbytes
+        self.scores = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(num_movies, width))
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def __contains__(self, movie_id):
+        return self.row(movie_id) is not None
+
+    def row(self, movie_id):
+        idx = int(np.searchsorted(self.movie_ids, movie_id))
+        if idx < len(self.movie_ids) and self.movie_ids[idx] == movie_id:
+            return idx
+        return None
+
+    def get(self, movie_id, recommendation_amount=None):
+        """
+        Returns the stored recommendation list of a movie ([] if the movie is not in the store).
+        """
+        idx = self.row(movie_id)
+        if idx is None:
+            return []
+        neighbors = self.neighbors[idx, :recommendation_amount]
+        return [int(mid) for mid in neighbors if mid >= 0]
+
+    def get_scores(self, movie_id, recommendation_amount=None):
+        """
+        Returns the similarity scores matching get(movie_id, recommendation_amount).
+        """
+        idx = self.row(movie_id)
+        if idx is None:
+            return []
+        neighbors = self.neighbors[idx, :recommendation_amount]
+        scores = self.scores[idx, :recommendation_amount]
+        return [float(score) for mid, score in zip(neighbors, scores) if mid >= 0]
+
+
+def write_neighbor_store(strategy, movie_ids, neighbors, scores=None):
+    """
+    Writes the recommendations of a strategy to its neighbour store file.
+
+    The file is written next to the old one and then atomically renamed, so workers that
+    still have the old file mapped keep reading a consistent version.
+
+    Parameters:
+    strategy (str): Name of the strategy (used as file name).
+    movie_ids (iterable): MovieLens IDs of the reference movies.
+    neighbors (iterable): For every reference movie, its recommended movie IDs in rank order.
+    scores (iterable, optional): For every reference movie, the similarity of each recommendation.
+
+    Returns:
+    str: Path of the written file.
+    """
+    movie_ids = np.asarray(list(movie_ids), dtype=np.int64)
+    neighbors = [list(row) for row in neighbors]
+    scores = [list(row) for row in scores] if scores is not None else [[] for _ in neighbors]
+    if not (len(movie_ids) == len(neighbors) == len(scores)):
+        raise ValueError("movie_ids, neighbors and scores must have the same length")
+
+    width = max((len(row) for row in neighbors), default=0)
+    neighbor_array = np.full((len(movie_ids), width), -1, dtype="<i4")
+    score_array = np.full((len(movie_ids), width), np.nan, dtype="<f4")
+    for i, (row, row_scores) in enumerate(zip(neighbors, scores)):
+        neighbor_array[i, :len(row)] = row
+        score_array[i, :len(row_scores)] = row_scores
+
+    order = np.argsort(movie_ids, kind="stable")
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header[0] = (MAGIC, VERSION, len(movie_ids), width, 0)
+
+    path = get_store_path(strategy)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.tobytes())
+        f.write(movie_ids[order].astype("<i4").tobytes())
+        f.write(neighbor_array[order].tobytes())
+        f.write(score_array[order].tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+def remove_neighbor_store(strategy):
+    """
+    Deletes the neighbour store of a strategy, so lookups fall back to the database rows.
+    """
+    try:
+        os.remove(get_store_path(strategy))
+    except FileNotFoundError:
+        pass
+
+
+def remove_all_neighbor_stores():
+    """
+    Deletes the neighbour stores of every strategy, e.g. after movies were removed, so lookups
+    fall back to the database rows (which cascade with the movies) until the stores are rebuilt.
+
+    Returns:
+    list: Names of the strategies whose store was removed.
+    """
+    try:
+        filenames = os.listdir(settings.NEIGHBOR_STORE_DIR)
+    except FileNotFoundError:
+        return []
+    strategies = [filename[:-len(".nbr")] for filename in filenames if filename.endswith(".nbr")]
+    for strategy in strategies:
+        remove_neighbor_store(strategy)
+    return strategies
+
+
+def open_neighbor_store(strategy):
+    """
+    Returns the NeighborStore of a strategy, or None if it has not been built.
+
+    Open stores are cached per process and reopened when the file is replaced.
+    """
+    path = get_store_path(strategy)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        _open_stores.pop(strategy, None)
+        return None
+
+    version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _open_stores.get(strategy)
+    if cached is None or cached[0] != version:
+        cached = (version, NeighborStore(path))
+        _open_stores[strategy] = cached
+    return cached[1]
@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+DEFAULT_FETCH_SETTINGS = {
+    "TMDB_API_URL": "https://api.themoviedb.org/3",     # base URL of the TMDB search API (or a local stub)
+    "TMDB_IMAGE_URL": "https://image.tmdb.org/t/p/w500", # prefix of TMDB poster paths
+    "CACHE_DIR": None,          # directory of cached search results and image bytes (None disables the cache)
+    "RATE_LIMITS": {"default": 0.05, "duckduckgo.com": 2.0},  # minimum seconds between requests per host
+    "RETRIES": 3,               # retries of failed requests (connection errors, 429 and 5xx responses)
+    "BACKOFF": 0.5,             # exponential backoff factor between retries, in seconds
+    "TIMEOUT": 10,              # seconds per request
+    "WORKERS": 8,               # concurrent fetches
+}
+
+# Response statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Pseudo host used to rate limit DuckDuckGo image searches, which do not go through the session
+DUCKDUCKGO_HOST = "duckduckgo.com"
+
+
+def get_fetch_settings():
+    return {**DEFAULT_FETCH_SETTINGS, **getattr(settings, "POSTER_FETCH", {})}
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces requests to the same host at least a minimum interval apart.
+
+    Parameters:
+    rate_limits (dict): Minimum seconds between two requests per host, with a "default" entry for all other hosts.
+    """
+
+    def __init__(self, rate_limits):
+        self.rate_limits = rate_limits
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        interval = self.rate_limits.get(host, self.rate_limits.get("default", 0))
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class PosterFetcher:
+    """
+    Fetches posters for movies without one: a TMDB search first, then a DuckDuckGo image search.
+
+    All HTTP requests share one pooled requests.Session (keep-alive connections) and go through a
+    per-host RateLimiter; retries with exponential backoff are made here rather than by urllib3, so
+    every attempt waits for the limiter too. Search results and downloaded
+    image bytes are cached on disk by movie_id, so a re-run never searches or downloads again.
+
+    Parameters:
+    api_key (str, optional): TMDB API key. Without it the TMDB search is skipped.
+    **overrides: Values overriding settings.POSTER_FETCH (see DEFAULT_FETCH_SETTINGS).
+    """
+
+    def __init__(self, api_key=None, **overrides):
+        self.settings = {**get_fetch_settings(), **overrides}
+        self.api_key = api_key
+        self.cache_dir = self.settings["CACHE_DIR"]
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self.rate_limiter = RateLimiter(self.settings["RATE_LIMITS"])
+
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.settings["WORKERS"], max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, url, **kwargs):
+        """
+        GETs a URL through the rate limiter, retrying connection errors, timeouts and RETRY_STATUSES
+        responses up to RETRIES times.
+
+        Notes:
+        The n-th retry sleeps BACKOFF * 2 ** n seconds, or as long as a numeric Retry-After header asks.
+        Every attempt, retries included, waits for the host's rate limiter slot.
+        """
+        host = urlsplit(url).hostname
+        retries = self.settings["RETRIES"]
+        for attempt in range(retries + 1):
+            self.rate_limiter.wait(host)
+            try:
+                response = self.session.get(url, timeout=self.settings["TIMEOUT"], **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    raise
+                delay = None
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    response.raise_for_status()
+                    return response
+                delay = self._retry_after(response)
+                response.close()
+            if delay is None:
+                delay = self.settings["BACKOFF"] * 2 ** attempt
+            if delay > 0:
+                time.sleep(delay)
+
+    @staticmethod
+    def _retry_after(response):
+        """Returns the seconds of a numeric Retry-After header, or None."""
+        try:
+            return max(0.0, float(response.headers.get("Retry-After", "")))
+        except ValueError:
+            return None
+
+    def _cache_path(self, movie_id, suffix):
+        return os.path.join(self.cache_dir, f"{movie_id}.{suffix}")
+
+    def _read_cache(self, movie_id):
+        if not self.cache_dir:
+            return None, None
+        try:
+            with open(self._cache_path(movie_id, "json"), "r") as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        try:
+            with open(self._cache_path(movie_id, "img"), "rb") as f:
+                return result, f.read()
+        except OSError:
+            return result, None
+
+    def _write_cache(self, movie_id, result, content=None):
+        if not self.cache_dir:
+            return
+        if content is not None:
+            with open(self._cache_path(movie_id, "img"), "wb") as f:
+                f.write(content)
+        # The search result is written last; it marks the cache entry as complete
+        with open(self._cache_path(movie_id, "json"), "w") as f:
+            json.dump(result, f)
+
+    def search_tmdb(self, title):
+        """Returns the poster URL of the first TMDB search result, or None."""
+        if not self.api_key:
+            return None
+        data = self.get(
+            f"{self.settings['TMDB_API_URL']}/search/movie",
+            params={"api_key": self.api_key, "query": title},
+        ).json()
+        for result in data.get("results", [])[:1]:
+            if result.get("poster_path"):
+                return f"{self.settings['TMDB_IMAGE_URL']}{result['poster_path']}"
+        return None
+
+    def search_web(self, title):
+        """Returns the URL of the first DuckDuckGo image result for the title, or None."""
+        from duckduckgo_search import DDGS
+
+        error = None
+        with DDGS() as ddgs:
+            for query in (f"{title} movie poster", title):
+                self.rate_limiter.wait(DUCKDUCKGO_HOST)
+                try:
+                    results = ddgs.images(query, max_results=1, safesearch="off")
+                except Exception as e:
+                    error = e
+                    continue
+                if results and results[0].get("image"):
+                    return results[0]["image"]
+        if error is not None:
+            raise error
+        return None
+
+    def fetch(self, movie_id, title):
+        """
+        Returns (content, source) with the poster image bytes of a movie and where they came from
+        ("tmdb" or "web"), or (None, None) if no poster was found.
+        """
+        result, content = self._read_cache(movie_id)
+        if result is not None and (content is not None or result.get("url") is None):
+            return content, result.get("source")
+
+        failed = False
+        for source, search in (("tmdb", self.search_tmdb), ("web", self.search_web)):
+            try:
+                url = search(title)
+                if url:
+                    content = self.get(url).content
+                    self._write_cache(movie_id, {"url": url, "source": source}, content)
+                    return content, source
+            except Exception:
+                failed = True
+
+        # Only remember that there is no poster if every search actually completed
+        if not failed:
+            self._write_cache(movie_id, {"url": None, "source": None})
+        return None, None
+
+    def fetch_all(self, movies):
+        """
+        Fetches the posters of many movies concurrently.
+
+        Parameters:
+        movies (iterable): (movie_id, title) pairs.
+
+        Returns:
+        iterator: (movie_id, title, content, source) tuples in completion order. Closing it early
+        cancels the fetches that have not started yet.
+        """
+        with ThreadPoolExecutor(max_workers=self.settings["WORKERS"]) as executor:
+            futures = {
+                executor.submit(self.fetch, movie_id, title): (movie_id, title) for movie_id, title in movies
+            }
+            try:
+                for future in as_completed(futures):
+                    movie_id, title = futures[future]
+                    try:
+                        content, source = future.result()
+                    except Exception:
+                        content, source = None, None
+                    yield movie_id, title, content, source
+            finally:
+                for future in futures:
+                    future.cancel()
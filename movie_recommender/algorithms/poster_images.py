@@ -0,0 +1,26 @@
+import os
+from io import BytesIO
+
+from PIL import Image
+
+# Kept free of Django imports: resize_poster runs in worker processes that never set Django up
+
+POSTER_SIZE = (500, 750)
+
+
+def resize_poster(content, path, size=POSTER_SIZE):
+    """
+    Decodes a fetched poster, scales it to size and writes it to path as JPEG (runs in a worker process).
+
+    JPEGs are decoded at a reduced scale with draft(), other formats are shrunk by an integer
+    factor with reduce() before the final resize, so large downloads are never fully resampled.
+    """
+    image = Image.open(BytesIO(content))
+    image.draft("RGB", size)
+    image = image.convert("RGB")
+    factor = min(image.width // size[0], image.height // size[1])
+    if factor > 1:
+        image = image.reduce(factor)
+    image = image.resize(size)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    image.save(path, format='JPEG')
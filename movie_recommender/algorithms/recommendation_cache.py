@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+from recommender.models import StrategyGeneration
+
+# Generation of the Movie table itself, bumped by import_movies.
+MOVIES_GENERATION = "movies"
+
+DEFAULT_CACHE_SETTINGS = {
+    "MAX_ENTRIES": 10000,   # size of the in-process LRU
+    "TTL": 300,             # seconds an entry stays valid in either cache layer
+    "GENERATION_TTL": 5,    # seconds between re-reading build generations from the database
+    "ALIAS": None,          # optional Django cache alias shared between workers (locmem/file/memcached)
+    "STATS_INTERVAL": 0,    # print the hit/miss counters every this many lookups (0 disables)
+}
+
+
+def get_cache_settings():
+    return {**DEFAULT_CACHE_SETTINGS, **getattr(settings, "RECOMMENDATION_CACHE", {})}
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe least-recently-used cache whose entries expire after ttl seconds.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache_settings = get_cache_settings()
+_local_cache = LRUCache(_cache_settings["MAX_ENTRIES"], _cache_settings["TTL"])
+_stats = {"local_hits": 0, "local_misses": 0, "shared_hits": 0, "shared_misses": 0}
+_generations = {}
+_generations_read_at = None
+
+
+def _shared_cache():
+    alias = _cache_settings["ALIAS"]
+    return caches[alias] if alias else None
+
+
+def get_generation(strategy):
+    """
+    Returns the current build generation of a strategy (0 if it was never built).
+
+    Generations are read from the database at most once every GENERATION_TTL seconds per process.
+    """
+    global _generations, _generations_read_at
+    now = time.monotonic()
+    if _generations_read_at is None or now - _generations_read_at > _cache_settings["GENERATION_TTL"]:
+        _generations = dict(StrategyGeneration.objects.values_list("strategy", "generation"))
+        _generations_read_at = now
+    return _generations.get(strategy, 0)
+
+
+def get_generation_state(strategies):
+    """
+    Reads the current generation and last build time of several strategies from the database.
+
+    Returns:
+    dict: {strategy: (generation, updated_at)}; strategies that were never built are missing.
+    """
+    rows = StrategyGeneration.objects.filter(strategy__in=list(strategies))
+    return {strategy: (generation, updated_at) for strategy, generation, updated_at
+            in rows.values_list("strategy", "generation", "updated_at")}
+
+
+def bump_generation(*strategies):
+    """
+    Increments the build generation of the given strategies, invalidating every cached lookup for them.
+    Called by the build commands once they have finished writing.
+    """
+    global _generations_read_at
+    for strategy in strategies:
+        StrategyGeneration.objects.get_or_create(strategy=strategy)
+    StrategyGeneration.objects.filter(strategy__in=strategies).update(
+        generation=F("generation") + 1, updated_at=timezone.now()
+    )
+    _generations_read_at = None
+
+
+def _cache_key(strategy, movie_id, recommendation_amount):
+    generation = f"{get_generation(strategy)}.{get_generation(MOVIES_GENERATION)}"
+    return f"rec:{strategy}:{generation}:{movie_id}:{recommendation_amount}"
+
+
+def get_cached_recommendation(strategy, movie_id, recommendation_amount):
+    """
+    Looks up a recommendation list in the in-process LRU, then in the shared cache.
+
+    Returns:
+    list: The cached movie IDs, or None on a miss.
+    """
+    value = _lookup(_cache_key(strategy, movie_id, recommendation_amount))
+    interval = _cache_settings["STATS_INTERVAL"]
+    if interval and (_stats["local_hits"] + _stats["local_misses"]) % interval == 0:
+        print(f"[INFO] Recommendation cache: {format_cache_stats(get_cache_stats())}")
+    return value
+
+
+def _lookup(key):
+    value = _local_cache.get(key)
+    if value is not None:
+        _stats["local_hits"] += 1
+        return value
+    _stats["local_misses"] += 1
+
+    shared = _shared_cache()
+    if shared is None:
+        return None
+    value = shared.get(key)
+    if value is None:
+        _stats["shared_misses"] += 1
+        return None
+    _stats["shared_hits"] += 1
+    _local_cache.set(key, value)
+    return value
+
+
+def set_cached_recommendation(strategy, movie_id, recommendation_amount, recommended_ids):
+    key = _cache_key(strategy, movie_id, recommendation_amount)
+    _local_cache.set(key, recommended_ids)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.set(key, recommended_ids, _cache_settings["TTL"])
+
+
+def get_cache_stats():
+    """
+    Returns the hit/miss counters of this process together with the current LRU size.
+    """
+    return {**_stats, "local_entries": len(_local_cache)}
+
+
+def format_cache_stats(stats):
+    """One-line summary of get_cache_stats(), e.g. for periodic log lines."""
+    lookups = stats["local_hits"] + stats["local_misses"]
+    hit_rate = stats["local_hits"] / lookups if lookups else 0
+    return (
+        f"{lookups} lookups, {stats['local_hits']} local hits ({hit_rate:.0%}), "
+        f"{stats['shared_hits']} shared hits, {stats['shared_misses']} shared misses, "
+        f"{stats['local_entries']} entries"
+    )
+
+
+def clear_local_cache():
+    global _generations_read_at
+    _local_cache.clear()
+    _generations_read_at = None
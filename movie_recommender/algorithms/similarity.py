@@ -0,0 +1,123 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy import sparse
+from threadpoolctl import threadpool_limits
+
+
+def normalize_rows(vectors):
+    """
+    L2-normalize every row of a matrix as float32.
+
+    Parameters:
+    vectors (array-like): Matrix of shape (num_items, dim).
+
+    Returns:
+    numpy.ndarray: float32 matrix with unit-length rows. All-zero rows are left as zeros.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_cosine_neighbors(vectors, top_k, block_size=1024, query_indices=None, n_jobs=1):
+    """
+    Compute the top-k cosine neighbours of every item without materializing the N×N matrix.
+
+    Similarities are computed block by block (block_size query rows against all items),
+    so peak memory is O(n_jobs·block_size·N) while the result is O(N·k).
+
+    Parameters:
+    vectors (array-like): Item matrix of shape (num_items, dim).
+    top_k (int): Number of neighbours to keep per item. The item itself is never included.
+    block_size (int): Number of query rows multiplied per block.
+    query_indices (array-like, optional): Only compute neighbours for these rows. Defaults to all rows.
+    n_jobs (int): Number of blocks processed concurrently (numpy releases the GIL for the heavy work).
+        With more than one job, BLAS is limited to one thread per block so the CPU is not oversubscribed.
+
+    Returns:
+    tuple: (indices, scores) where indices is an int32 array of shape (num_queries, k) holding
+    row positions into vectors and scores is the matching float32 cosine similarity array,
+    both sorted by descending similarity (ties broken by lower row position).
+    """
+    matrix = normalize_rows(vectors)
+    num_items = matrix.shape[0]
+    if query_indices is None:
+        query_indices = np.arange(num_items)
+    query_indices = np.asarray(query_indices, dtype=np.int64)
+
+    k = min(top_k, num_items - 1)
+    indices = np.empty((len(query_indices), max(k, 0)), dtype=np.int32)
+    scores = np.empty((len(query_indices), max(k, 0)), dtype=np.float32)
+    if k <= 0:
+        return indices, scores
+
+    def process_block(start):
+        rows = query_indices[start:start + block_size]
+        sims = matrix[rows] @ matrix.T
+        sims[np.arange(len(rows)), rows] = -np.inf
+
+        candidates = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(sims, candidates, axis=1)
+        order = np.lexsort((candidates, -candidate_scores), axis=1)
+
+        indices[start:start + len(rows)] = np.take_along_axis(candidates, order, axis=1)
+        scores[start:start + len(rows)] = np.take_along_axis(candidate_scores, order, axis=1)
+
+    starts = range(0, len(query_indices), block_size)
+    if n_jobs > 1:
+        with threadpool_limits(limits=1, user_api="blas"), ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            list(executor.map(process_block, starts))
+    else:
+        for start in starts:
+            process_block(start)
+
+    return indices, scores
+
+
+def angular_to_cosine(distances):
+    """
+    Converts Annoy 'angular' distances (sqrt(2 - 2·cos)) back to cosine similarities.
+    """
+    distances = np.asarray(distances, dtype=np.float32)
+    return 1.0 - distances ** 2 / 2.0
+
+
+def sparse_top_k_cosine_neighbors(matrix, top_k, block_size=4096):
+    """
+    Compute the top-k cosine neighbours of every row of a sparse matrix.
+
+    The transposed matrix acts as an inverted index (feature -> rows), so each block of rows is only
+    scored against the rows it shares at least one non-zero feature with. Time and memory scale with
+    the number of co-occurring pairs instead of num_rows² or the feature vocabulary size.
+
+    Parameters:
+    matrix (scipy.sparse matrix): Item matrix of shape (num_items, num_features).
+    top_k (int): Number of neighbours to keep per item. The item itself is never included.
+    block_size (int): Number of rows scored per sparse product.
+
+    Returns:
+    tuple: (indices, scores), one int32 and one float32 array per item, sorted by descending similarity
+    (ties broken by lower row position). Items with fewer than top_k co-occurring items get shorter arrays.
+    """
+    matrix = sparse.csr_matrix(matrix, dtype=np.float32)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    matrix = sparse.csr_matrix(sparse.diags(1.0 / norms).dot(matrix), dtype=np.float32)
+    inverted_index = matrix.T.tocsr()
+
+    all_indices, all_scores = [], []
+    for start in range(0, matrix.shape[0], block_size):
+        sims = (matrix[start:start + block_size] @ inverted_index).tocsr()
+        for row in range(sims.shape[0]):
+            begin, end = sims.indptr[row], sims.indptr[row + 1]
+            candidates = sims.indices[begin:end]
+            candidate_scores = sims.data[begin:end]
+            keep = candidates != start + row
+            candidates, candidate_scores = candidates[keep], candidate_scores[keep]
+
+            order = np.lexsort((candidates, -candidate_scores))[:top_k]
+            all_indices.append(candidates[order].astype(np.int32))
+            all_scores.append(candidate_scores[order].astype(np.float32))
+
+    return all_indices, all_scores
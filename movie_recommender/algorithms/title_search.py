@@ -0,0 +1,103 @@
+import re
+from collections import namedtuple
+from django.db import OperationalError, connection, transaction
+from recommender.models import Movie
+
+# SQLite FTS5 table holding every movie title, with the movie ID as rowid
+INDEX_TABLE = "movie_title_fts"
+TOKEN_RE = re.compile(r"\w+")
+
+SearchResults = namedtuple("SearchResults", ["movies", "total", "page", "num_pages"])
+
+
+def title_index_exists():
+    """True if the title search index has been built in the current database (a single indexed lookup)."""
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [INDEX_TABLE])
+        return cursor.fetchone() is not None
+
+
+def rebuild_title_index():
+    """
+    Rebuilds the FTS5 title search index from Movie.title.
+
+    The index uses the unicode61 tokenizer with diacritic removal, so "amelie" matches "Amélie".
+
+    Returns:
+    int: Number of indexed titles, or None if the database does not support FTS5 (search then
+    falls back to a plain database query).
+    """
+    if connection.vendor != "sqlite":
+        return None
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {INDEX_TABLE}")
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {INDEX_TABLE} USING fts5(title, tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                f"INSERT INTO {INDEX_TABLE}(rowid, title) SELECT movie_id, title FROM {Movie._meta.db_table}"
+            )
+            cursor.execute(f"INSERT INTO {INDEX_TABLE}({INDEX_TABLE}) VALUES('optimize')")
+            cursor.execute(f"SELECT count(*) FROM {INDEX_TABLE}")
+            return cursor.fetchone()[0]
+    except OperationalError:
+        # SQLite compiled without FTS5
+        return None
+
+
+def build_match_query(query):
+    """
+    Turns free text into an FTS5 query in which every word must match the start of a title word,
+    e.g. 'star wa' -> '"star"* "wa"*'. Returns "" if the text contains no words.
+    """
+    return " ".join(f'"{token}"*' for token in TOKEN_RE.findall(query))
+
+
+def search_titles(query, page=1, per_page=24):
+    """
+    Searches movie titles, best matches first.
+
+    Parameters:
+    query (str): Free text; every word is matched as a prefix of a title word.
+    page (int): 1-based page number, clamped to the available pages.
+    per_page (int): Number of movies per page.
+
+    Returns:
+    SearchResults: The movies of the page, the total number of matches, the page number and the number of pages.
+
+    Notes:
+    With the FTS5 index (built by import_movies) results are ranked by bm25 and diacritics are
+    ignored. Without it, titles containing every word are returned in alphabetical order.
+    """
+    tokens = TOKEN_RE.findall(query or "")
+    if not tokens:
+        return SearchResults([], 0, 1, 1)
+
+    if title_index_exists():
+        match = build_match_query(query)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH %s", [match])
+            total = cursor.fetchone()[0]
+            num_pages = max(1, -(-total // per_page))
+            page = min(max(1, page), num_pages)
+            cursor.execute(
+                f"SELECT rowid FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH %s "
+                f"ORDER BY bm25({INDEX_TABLE}), rowid LIMIT %s OFFSET %s",
+                [match, per_page, (page - 1) * per_page],
+            )
+            movie_ids = [row[0] for row in cursor.fetchall()]
+        movies_by_id = Movie.objects.in_bulk(movie_ids)
+        movies = [movies_by_id[movie_id] for movie_id in movie_ids if movie_id in movies_by_id]
+        return SearchResults(movies, total, page, num_pages)
+
+    movies = Movie.objects.all()
+    for token in tokens:
+        movies = movies.filter(title__icontains=token)
+    total = movies.count()
+    num_pages = max(1, -(-total // per_page))
+    page = min(max(1, page), num_pages)
+    movies = list(movies.order_by("title", "movie_id")[(page - 1) * per_page:page * per_page])
+    return SearchResults(movies, total, page, num_pages)
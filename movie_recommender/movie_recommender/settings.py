@@ -78,6 +78,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # run_all builds independent stages in parallel processes; wait for their write locks
+        'OPTIONS': {'timeout': 60},
     }
 }
 
@@ -127,4 +129,51 @@ STATICFILES_DIRS = [
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Recommendation lookup cache
+# Lookups are cached in a bounded in-process LRU. Set ALIAS to one of the CACHES
+# aliases (locmem, file based, memcached, ...) to also share entries between workers.
+# STATS_INTERVAL > 0 prints the hit/miss counters of each worker every that many lookups.
+
+RECOMMENDATION_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TTL': 300,
+    'GENERATION_TTL': 5,
+    'ALIAS': None,
+    'STATS_INTERVAL': 0,
+}
+
+# Directory of the memory-mapped neighbour store files written by the build commands
+# (see algorithms/neighbor_store.py). Lookups prefer these files over the database rows.
+
+NEIGHBOR_STORE_DIR = os.path.join(BASE_DIR, 'neighbor_store')
+
+# Directory of the persisted LDA dictionary, model, topic vectors and Annoy index
+# (see LdaData in algorithms/algorithm_plot_topic.py), reused by build_plot_recommendations.
+
+LDA_ARTIFACT_DIR = os.path.join(BASE_DIR, 'lda_artifacts')
+
+# Movie IDs added, updated and removed by the last import_movies run
+# (see algorithms/import_changeset.py), used to skip downstream work on unchanged data.
+
+IMPORT_CHANGESET_PATH = os.path.join(BASE_DIR, 'import_changeset.json')
+
+# Per-stage status, timing and row counts of the last run_all pipeline, used to resume it.
+
+PIPELINE_STATE_PATH = os.path.join(BASE_DIR, 'pipeline_state.json')
+
+# Web poster fetching of import_movies --fetch-posters (see algorithms/poster_fetcher.py).
+# The TMDB URLs can be pointed at a local stub server; search results and image bytes are
+# cached in CACHE_DIR by movie ID so re-runs never download a poster twice.
+
+POSTER_FETCH = {
+    'TMDB_API_URL': os.getenv('TMDB_API_URL', 'https://api.themoviedb.org/3'),
+    'TMDB_IMAGE_URL': os.getenv('TMDB_IMAGE_URL', 'https://image.tmdb.org/t/p/w500'),
+    'CACHE_DIR': os.path.join(BASE_DIR, 'poster_cache'),
+    'RATE_LIMITS': {'default': 0.05, 'duckduckgo.com': 2.0},
+    'RETRIES': 3,
+    'BACKOFF': 0.5,
+    'TIMEOUT': 10,
+    'WORKERS': 8,
+}
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+import os
+import time
+
+from algorithms.algorithm_plot_topic import LemmaCache, clean_text, lemma_pos, load_movies, setup_nltk
+
+
+class Command(BaseCommand):
+    help = "Compare docs/sec of the legacy per-word plot preprocessing with the cached LemmaCache path"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=2000,
+            help='Number of movie plots to preprocess (0 for all)'
+        )
+
+    def handle(self, *args, **options):
+        this_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+        data_dir = os.path.abspath(os.path.join(this_dir, "datasets", "information"))
+        if not os.path.exists(data_dir):
+            self.stdout.write(self.style.ERROR(f"Data directory not found: {data_dir}"))
+            return
+
+        setup_nltk()
+        stop_words = set(stopwords.words("english"))
+        lemmatizer = WordNetLemmatizer()
+        raw_texts, _, _ = load_movies(data_dir)
+        if options['limit']:
+            raw_texts = raw_texts[:options['limit']]
+        if not raw_texts:
+            self.stdout.write(self.style.WARNING("No movie plots found"))
+            return
+
+        # Warm up the tagger and WordNet so neither run pays their loading time
+        lemma_pos(clean_text(raw_texts[0], stop_words), lemmatizer)
+
+        start = time.perf_counter()
+        legacy = [lemma_pos(clean_text(txt, stop_words), lemmatizer) for txt in raw_texts]
+        legacy_seconds = time.perf_counter() - start
+
+        cache = LemmaCache(lemmatizer)
+        start = time.perf_counter()
+        fast = [cache.lemmatize_text(clean_text(txt, stop_words)) for txt in raw_texts]
+        fast_seconds = time.perf_counter() - start
+
+        mismatches = sum(1 for a, b in zip(legacy, fast) if a != b)
+        lookups = cache.hits + cache.misses
+        self.stdout.write(f"{'Engine':<10}{'Docs':>8}{'Seconds':>10}{'Docs/sec':>12}")
+        for name, seconds in (("legacy", legacy_seconds), ("cached", fast_seconds)):
+            self.stdout.write(f"{name:<10}{len(raw_texts):>8}{seconds:>10.2f}{len(raw_texts) / seconds:>12.1f}")
+        self.stdout.write(
+            f"Lemma cache: {len(cache.lemmas)} entries, hit rate {cache.hits / lookups if lookups else 0:.1%}"
+        )
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"{mismatches} documents differ from the legacy output"))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Outputs identical, speedup {legacy_seconds / fast_seconds if fast_seconds else float('inf'):.1f}x"
+            ))
@@ -1,18 +1,50 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from recommender.models import MovieImageEmbedding, MovieImageRecommendation
+from algorithms.recommendation_cache import bump_generation
+from algorithms.neighbor_store import remove_neighbor_store, write_neighbor_store
+from algorithms.similarity import normalize_rows, top_k_cosine_neighbors
 from annoy import AnnoyIndex
+import hashlib
 from tqdm import tqdm
 import numpy as np
+import time
 
 class Command(BaseCommand):
-    help = "Precompute and store image-based movie recommendations using Annoy"
+    help = "Precompute and store image-based movie recommendations (exact blocked search, Annoy for huge catalogs)"
 
     def add_arguments(self, parser):
         parser.add_argument(
             '--top-k',
             type=int,
             default=5,
-            help='Number of similar movies to store per movie (required for Annoy)'
+            help='Number of similar movies to store per movie'
+        )
+        parser.add_argument(
+            '--engine',
+            choices=['auto', 'exact', 'annoy'],
+            default='auto',
+            help='exact: blocked matrix multiplication over all embeddings; annoy: approximate index; '
+                 'auto: exact unless the catalog is larger than --annoy-threshold'
+        )
+        parser.add_argument(
+            '--annoy-threshold',
+            type=int,
+            default=500000,
+            help='Number of embeddings above which the auto engine switches to Annoy'
+        )
+        parser.add_argument(
+            '--block-size',
+            type=int,
+            default=1024,
+            help='Number of movies per similarity block of the exact engine (bounds peak memory)'
+        )
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            default=1,
+            help='Number of similarity blocks computed in parallel by the exact engine '
+                 '(each block then uses a single BLAS thread; with 1, BLAS parallelizes every block itself)'
         )
         parser.add_argument(
             '--num-trees',
@@ -20,72 +52,162 @@ class Command(BaseCommand):
             default=50,
             help='Number of trees for Annoy index (higher = more accurate, slower to build)'
         )
+        parser.add_argument(
+            '--output',
+            choices=['db', 'store', 'both'],
+            default='both',
+            help='Write recommendations to the database, the memory-mapped neighbour store, or both'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Recompute every movie instead of only those affected by changed embeddings'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows per bulk insert statement'
+        )
+
+    def find_affected(self, embeddings, ids, versions, existing, top_k, block_size=1024):
+        """
+        Returns a boolean mask of the movies whose recommendations have to be recomputed.
+
+        versions identifies every movie's current embedding (the poster hash and a checksum of the
+        vector) and existing maps movie IDs to (recommended movie IDs, version they were computed for).
+        A movie is affected if its own embedding changed, if its list contains a changed or removed
+        movie or is shorter than top_k, or if a changed embedding is now more similar to it than its
+        current k-th recommendation.
+        """
+        index_of = {movie_id: i for i, movie_id in enumerate(ids)}
+        changed = np.array([
+            movie_id not in existing or existing[movie_id][1] != version
+            for movie_id, version in zip(ids, versions)
+        ], dtype=bool)
+        changed_ids = {movie_id for movie_id, is_changed in zip(ids, changed) if is_changed}
+        affected = changed.copy()
+
+        kth_similarity = np.full(len(ids), np.inf, dtype=np.float32)
+        for i, movie_id in enumerate(ids):
+            if affected[i]:
+                continue
+            recommended = existing[movie_id][0]
+            if len(recommended) < top_k or any(r in changed_ids or r not in index_of for r in recommended):
+                affected[i] = True
+                continue
+            kth_similarity[i] = embeddings[i] @ embeddings[index_of[recommended[top_k - 1]]]
+
+        # Only embeddings that actually changed can displace an existing recommendation
+        changed_vectors = embeddings[np.flatnonzero(changed)]
+        for start in range(0, len(changed_vectors), block_size):
+            best_changed = (embeddings @ changed_vectors[start:start + block_size].T).max(axis=1)
+            affected |= best_changed >= kth_similarity
+        return affected
 
     def handle(self, *args, **options):
         top_k = options['top_k']
         num_trees = options['num_trees']
+        write_db = options['output'] in ('db', 'both')
+        write_store = options['output'] in ('store', 'both')
+        # Incremental runs need the previous recommendations, which are only kept in the database
+        full = options['full'] or not write_db
         embeddings = []
         ids = []
-        movie_lookup = {}
+        versions = []
 
-        for emb in MovieImageEmbedding.objects.select_related("movie"):
+        for emb in MovieImageEmbedding.objects.only("movie_id", "embedding", "poster_hash").order_by("movie_id"):
             vec = emb.get_embedding()
             embeddings.append(vec)
-            ids.append(emb.movie.movie_id)
-            movie_lookup[emb.movie.movie_id] = emb.movie
+            ids.append(emb.movie_id)
+            # The checksum catches re-embedded posters (e.g. a new model) whose poster_hash did not change
+            versions.append((emb.poster_hash, hashlib.sha1(vec.tobytes()).hexdigest()))
 
         if not embeddings:
             tqdm.write("[WARN] No embeddings found")
             return
 
-        embeddings = np.vstack(embeddings).astype("float32")
-        dim = embeddings.shape[1]
-        index = AnnoyIndex(dim, 'angular')  # 'angular' ≈ cosine similarity
-
-        tqdm.write(f"[INFO] Building Annoy index with {num_trees} trees...")
-        for i, vec in enumerate(embeddings):
-            index.add_item(i, vec)
-
-        index.build(num_trees)
-
-        updated = 0
-        skipped = 0
-
-        progress = tqdm(enumerate(ids), total=len(ids), desc="Generating recommendations", unit="movie")
-
-        for idx, movie_id in progress:
-            try:
-                movie = movie_lookup[movie_id]
-                progress.set_postfix_str(movie.title[:40]) 
-                should_skip = False
-
-                try:
-                    existing = MovieImageRecommendation.objects.get(movie=movie)
-                    if len(existing.recommended_movies) >= top_k:
-                        skipped += 1
-                        should_skip = True
-                except MovieImageRecommendation.DoesNotExist:
-                    pass
-
-                if should_skip:
-                    continue
-
-                query_k = top_k + 1
-                nearest_indices = index.get_nns_by_item(idx, query_k, search_k=-1)
-
-                top_similar = [
-                    int(ids[i])
-                    for i in nearest_indices
-                    if ids[i] != movie_id
-                ]
-
-                MovieImageRecommendation.objects.update_or_create(
-                    movie=movie,
-                    defaults={"recommended_movies": top_similar}
+        embeddings = normalize_rows(np.vstack(embeddings))
+        index_of = {movie_id: i for i, movie_id in enumerate(ids)}
+
+        existing = {} if full else {
+            movie_id: (recommended_movies, (poster_hash, embedding_hash))
+            for movie_id, recommended_movies, poster_hash, embedding_hash
+            in MovieImageRecommendation.objects.values_list(
+                "movie_id", "recommended_movies", "poster_hash", "embedding_hash"
+            )
+        }
+        affected = self.find_affected(embeddings, ids, versions, existing, top_k)
+        tqdm.write(f"[INFO] {int(affected.sum())} of {len(ids)} movies need new recommendations")
+
+        recommendations = {
+            movie_id: existing[movie_id][0][:top_k]
+            for movie_id, is_affected in zip(ids, affected) if not is_affected
+        }
+
+        to_write = []
+        affected_rows = np.flatnonzero(affected)
+        engine = options['engine']
+        if engine == 'auto':
+            engine = 'annoy' if len(ids) > options['annoy_threshold'] else 'exact'
+
+        if len(affected_rows) and engine == 'exact':
+            tqdm.write(f"[INFO] Computing exact top-{top_k} neighbours with {options['jobs']} threads...")
+            neighbor_rows, _ = top_k_cosine_neighbors(
+                embeddings, top_k, block_size=options['block_size'], query_indices=affected_rows, n_jobs=options['jobs']
+            )
+        elif len(affected_rows):
+            dim = embeddings.shape[1]
+            index = AnnoyIndex(dim, 'angular')  # 'angular' ≈ cosine similarity
+
+            tqdm.write(f"[INFO] Building Annoy index with {num_trees} trees...")
+            for i, vec in enumerate(embeddings):
+                index.add_item(i, vec)
+
+            index.build(num_trees)
+
+            neighbor_rows = [
+                [i for i in index.get_nns_by_item(int(idx), top_k + 1) if i != idx][:top_k]
+                for idx in tqdm(affected_rows, desc="Generating recommendations", unit="movie")
+            ]
+        else:
+            neighbor_rows = []
+
+        for idx, rows in zip(affected_rows, neighbor_rows):
+            movie_id = ids[idx]
+            top_similar = [int(ids[i]) for i in rows]
+            recommendations[movie_id] = top_similar
+            poster_hash, embedding_hash = versions[idx]
+            to_write.append(MovieImageRecommendation(
+                movie_id=movie_id, recommended_movies=top_similar, poster_hash=poster_hash,
+                embedding_hash=embedding_hash,
+            ))
+
+        if write_db and to_write:
+            start = time.perf_counter()
+            with transaction.atomic():
+                MovieImageRecommendation.objects.bulk_create(
+                    to_write,
+                    batch_size=options['batch_size'],
+                    update_conflicts=True,
+                    unique_fields=["movie"],
+                    update_fields=["recommended_movies", "poster_hash", "embedding_hash"],
                 )
-                updated += 1
-
-            except Exception as e:
-                tqdm.write(f"[ERROR] Failed for movie {movie_id}: {e}")
-
-        tqdm.write(f"[DONE] Recommendations complete. Updated or created: {updated}, Skipped: {skipped}")
+            elapsed = time.perf_counter() - start
+            tqdm.write(f"[INFO] Wrote {len(to_write)} rows in {elapsed:.2f}s ({len(to_write) / elapsed if elapsed else 0:.0f} rows/sec)")
+        updated = len(to_write)
+
+        if write_store:
+            store_ids = [movie_id for movie_id in ids if movie_id in recommendations]
+            store_neighbors = [recommendations[movie_id] for movie_id in store_ids]
+            store_scores = [
+                embeddings[index_of[movie_id]] @ embeddings[[index_of[r] for r in neighbors]].T
+                for movie_id, neighbors in zip(store_ids, store_neighbors)
+            ]
+            path = write_neighbor_store("image", store_ids, store_neighbors, store_scores)
+            tqdm.write(f"[INFO] Neighbour store written to {path}")
+        else:
+            remove_neighbor_store("image")
+
+        bump_generation("image")
+        tqdm.write(f"[DONE] Recommendations complete. Updated or created: {updated}, Unchanged: {len(ids) - updated}")
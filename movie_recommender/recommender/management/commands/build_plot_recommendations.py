@@ -1,10 +1,15 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from recommender.models import Movie, MovieLdaEmbedding, MoviePlotRecommendation
 from algorithms.algorithm_plot_topic import LdaData
+from algorithms.recommendation_cache import bump_generation
+from algorithms.neighbor_store import remove_neighbor_store, write_neighbor_store
 from tqdm import tqdm
 import numpy as np
 import os
+import time
 from itertools import islice, chain
+from django.conf import settings
 
 class Command(BaseCommand):
     help = "Precompute and store plot-based movie recommendations using LDA"
@@ -21,12 +26,79 @@ class Command(BaseCommand):
             action='store_true',
             help='Clear existing plot recommendations before computing new ones'
         )
+        parser.add_argument(
+            '--output',
+            choices=['db', 'store', 'both'],
+            default='both',
+            help='Write recommendations to the database, the memory-mapped neighbour store, or both'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows per bulk insert/update statement'
+        )
+        parser.add_argument(
+            '--retrain',
+            action='store_true',
+            help='Ignore the persisted LDA artefacts and train a new model'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=min(8, os.cpu_count() or 1),
+            help='Number of processes loading and preprocessing the movie files (and training with --multicore)'
+        )
+        parser.add_argument(
+            '--num-topics',
+            type=int,
+            default=50,
+            help='Number of LDA topics'
+        )
+        parser.add_argument(
+            '--passes',
+            type=int,
+            default=10,
+            help='Number of LDA training passes over the corpus'
+        )
+        parser.add_argument(
+            '--chunksize',
+            type=int,
+            default=100,
+            help='Number of documents per LDA training chunk'
+        )
+        parser.add_argument(
+            '--multicore',
+            action='store_true',
+            help="Train with gensim's multicore LDA (symmetric alpha prior instead of a learned one)"
+        )
 
     def chunked(self, iterable, size):
         """Split iterable into chunks of specified size to avoid SQL variable limits."""
         it = iter(iterable)
         return iter(lambda: list(islice(it, size)), [])
 
+    def save_embeddings(self, lda_data, movies, batch_size):
+        """Upsert the topic vector of every movie into MovieLdaEmbedding."""
+        embeddings = []
+        for movie in movies:
+            embedding = MovieLdaEmbedding(movie=movie)
+            embedding.set_embedding(lda_data.topic_vectors[lda_data.movie_id_to_index[movie.movie_id]])
+            embeddings.append(embedding)
+        current = {movie.movie_id for movie in movies}
+        stale = [mid for mid in MovieLdaEmbedding.objects.values_list("movie_id", flat=True) if mid not in current]
+        with transaction.atomic():
+            for chunk in self.chunked(stale, 900):
+                MovieLdaEmbedding.objects.filter(movie_id__in=chunk).delete()
+            MovieLdaEmbedding.objects.bulk_create(
+                embeddings,
+                update_conflicts=True,
+                unique_fields=["movie"],
+                update_fields=["embedding"],
+                batch_size=batch_size,
+            )
+        self.stdout.write(f"Saved {len(embeddings)} LDA topic vectors")
+
     def handle(self, *args, **options):
         top_k = options['top_k']
         clear_existing = options['clear']
@@ -46,7 +118,17 @@ class Command(BaseCommand):
         
         # Initialize LDA system (this will show progress bars)
         self.stdout.write("Initializing LDA recommendation system...")
-        lda_data = LdaData(data_dir)
+        lda_data = LdaData(
+            data_dir,
+            num_topics=options['num_topics'],
+            passes=options['passes'],
+            artifact_dir=settings.LDA_ARTIFACT_DIR,
+            retrain=options['retrain'],
+            workers=options['workers'],
+            chunksize=options['chunksize'],
+            multicore=options['multicore'],
+        )
+        self.stdout.write(f"LDA model {lda_data.status} ({len(lda_data.movie_ids)} movies)")
         
         # Get all movies that have LDA data
         movie_ids_with_lda = set(lda_data.movie_ids)
@@ -65,41 +147,64 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING("No movies found with LDA data"))
             return
 
+        self.save_embeddings(lda_data, movies, options['batch_size'])
+
         self.stdout.write(f"Computing recommendations for {len(movies)} movies...")
         
         updated = 0
-        skipped = 0
-        
-        progress = tqdm(movies, desc="Generating plot recommendations", unit="movie")
+        removed = 0
+        write_db = options['output'] in ('db', 'both')
+        results = {}
         
-        for movie in progress:
-            try:
-                progress.set_postfix_str(movie.title[:40])
-                
-                # Check if we already have recommendations for this movie
+        if options['output'] in ('store', 'both'):
+            for movie in movies:
+                results[movie.movie_id] = lda_data.get_recommendations(movie.movie_id, top_k, with_scores=True)
+            path = write_neighbor_store(
+                "plot",
+                results.keys(),
+                [recommendations for recommendations, _ in results.values()],
+                [scores for _, scores in results.values()],
+            )
+            self.stdout.write(f"Neighbour store written to {path}")
+        else:
+            remove_neighbor_store("plot")
+
+        if write_db:
+            start = time.perf_counter()
+            # Every row is rewritten: a retrained or updated model changes the neighbours of existing movies too
+            rows = []
+            for movie in tqdm(movies, desc="Generating plot recommendations", unit="movie"):
                 try:
-                    existing = MoviePlotRecommendation.objects.get(movie=movie)
-                    if len(existing.recommended_movies) >= top_k:
-                        skipped += 1
-                        continue
-                except MoviePlotRecommendation.DoesNotExist:
-                    pass
-                
-                # Get recommendations
-                recommendations = lda_data.get_recommendations(movie.movie_id, top_k)
-                
-                # Store recommendations
-                MoviePlotRecommendation.objects.update_or_create(
-                    movie=movie,
-                    defaults={"recommended_movies": recommendations}
+                    if movie.movie_id in results:
+                        recommendations = results[movie.movie_id][0]
+                    else:
+                        recommendations = lda_data.get_recommendations(movie.movie_id, top_k)
+                    rows.append(MoviePlotRecommendation(movie=movie, recommended_movies=recommendations))
+                except Exception as e:
+                    self.stdout.write(f"[ERROR] Failed for movie {movie.movie_id}: {e}")
+
+            current = {movie.movie_id for movie in movies}
+            stale = [
+                mid for mid in MoviePlotRecommendation.objects.values_list("movie_id", flat=True) if mid not in current
+            ]
+            with transaction.atomic():
+                for chunk in self.chunked(stale, 900):
+                    MoviePlotRecommendation.objects.filter(movie_id__in=chunk).delete()
+                MoviePlotRecommendation.objects.bulk_create(
+                    rows,
+                    batch_size=options['batch_size'],
+                    update_conflicts=True,
+                    unique_fields=["movie"],
+                    update_fields=["recommended_movies"],
                 )
-                updated += 1
-                
-            except Exception as e:
-                self.stdout.write(f"[ERROR] Failed for movie {movie.movie_id}: {e}")
+            updated = len(rows)
+            removed = len(stale)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"Wrote {updated} rows in {elapsed:.2f}s ({updated / elapsed if elapsed else 0:.0f} rows/sec)")
         
+        bump_generation("plot")
         self.stdout.write(
             self.style.SUCCESS(
-                f"Plot recommendations complete. Updated: {updated}, Skipped: {skipped}"
+                f"Plot recommendations complete. Updated: {updated}, Removed: {removed}"
             )
         ) 
\ No newline at end of file
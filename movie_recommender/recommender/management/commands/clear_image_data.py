@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from recommender.models import MovieImageEmbedding, MovieImageRecommendation
+from algorithms.recommendation_cache import bump_generation
 
 class Command(BaseCommand):
     help = "Clear all stored image embeddings and recommendations"
@@ -15,6 +16,7 @@ class Command(BaseCommand):
 
         MovieImageEmbedding.objects.all().delete()
         MovieImageRecommendation.objects.all().delete()
+        bump_generation("image")
 
         self.stdout.write(self.style.SUCCESS(
             f"Cleared {num_embeddings} embeddings and {num_recommendations} recommendations."
@@ -1,21 +1,55 @@
 from django.core.management.base import BaseCommand
 import numpy as np
-import faiss
+from scipy import sparse
 from tqdm import tqdm
 
 from recommender.models import Movie, MovieCollaboratorRecommendation
+from algorithms.recommendation_cache import bump_generation
+from algorithms.neighbor_store import remove_neighbor_store, write_neighbor_store
+from algorithms.similarity import sparse_top_k_cosine_neighbors
 
 
 class Command(BaseCommand):
-    help = "Generate movie recommendations based on collaborators similarity using FAISS"
+    help = "Generate movie recommendations based on (weighted) shared collaborators using a sparse inverted index"
 
     def add_arguments(self, parser):
         parser.add_argument("--top-k", type=int, default=10)
+        parser.add_argument(
+            "--output",
+            choices=["db", "store", "both"],
+            default="both",
+            help="Write recommendations to the database, the memory-mapped neighbour store, or both"
+        )
+        parser.add_argument(
+            "--block-size",
+            type=int,
+            default=4096,
+            help="Number of movies scored per sparse matrix product"
+        )
+        parser.add_argument(
+            "--weighting",
+            choices=["binary", "idf", "idf-billing"],
+            default="binary",
+            help="binary: every collaborator counts 1; idf: rare collaborators count more; "
+                 "idf-billing: idf plus billing-order decay for actors and a boost for directors"
+        )
+        parser.add_argument(
+            "--billing-decay",
+            type=float,
+            default=0.8,
+            help="Weight factor applied per billing position (lead actor = 1, second = decay, third = decay², ...)"
+        )
+        parser.add_argument(
+            "--director-boost",
+            type=float,
+            default=1.5,
+            help="Role weight of directors relative to the lead actor"
+        )
 
     def handle(self, *args, **kwargs):
         tqdm.write("[INFO] Starting Collaborator recommendation generation...")
 
-        movies = list(Movie.objects.only("movie_id", "directors", "actors"))
+        movies = list(Movie.objects.only("movie_id", "directors", "actors").order_by("movie_id"))
         if not movies:
             tqdm.write("[WARN] No movies found in database.")
             return
@@ -26,61 +60,98 @@ class Command(BaseCommand):
         def get_collaborators(movie):
             directors = [d.strip().lower() for d in movie.directors.split(',') if d.strip()]
             actors = [a.strip().lower() for a in movie.actors.split(',') if a.strip()][:5]
-            return directors + actors
+            return directors, actors
 
         tqdm.write(f"[INFO] Extracting Collaborators from {len(movies)} movies...")
         all_collaborators = set()
         for movie in movies:
-            all_collaborators.update(get_collaborators(movie))
+            directors, actors = get_collaborators(movie)
+            all_collaborators.update(directors)
+            all_collaborators.update(actors)
 
         collaborator_list = sorted(all_collaborators)
         collaborator_to_idx = {collaborator: idx for idx, collaborator in enumerate(collaborator_list)}
         dim = len(collaborator_list)
         tqdm.write(f"[INFO] Total unique Collaborators: {dim}")
 
-        # Build movie vectors
-        def movie_to_vector(movie):
-            vec = np.zeros(dim, dtype=np.float32)
-            for collaborator in get_collaborators(movie):
-                idx = collaborator_to_idx.get(collaborator)
-                if idx is not None:
-                    vec[idx] = 1.0
-            return vec
-
+        # Collect (movie, collaborator, role weight) entries of the incidence matrix
         tqdm.write("[INFO] Vectorizing movies...")
-        movie_vectors = np.array([movie_to_vector(movie) for movie in movies], dtype=np.float32)
-        faiss.normalize_L2(movie_vectors)
-
-        # Build FAISS index
-        tqdm.write("[INFO] Building FAISS index...")
-        index = faiss.IndexFlatIP(dim)
-        index.add(movie_vectors)
-        tqdm.write("[INFO] FAISS index built successfully.")
+        director_boost = kwargs["director_boost"]
+        billing_decay = kwargs["billing_decay"]
+        rows, cols, roles = [], [], []
+        for i, movie in enumerate(movies):
+            directors, actors = get_collaborators(movie)
+            for director in directors:
+                rows.append(i)
+                cols.append(collaborator_to_idx[director])
+                roles.append(director_boost)
+            for position, actor in enumerate(actors):
+                rows.append(i)
+                cols.append(collaborator_to_idx[actor])
+                roles.append(billing_decay ** position)
+
+        rows = np.asarray(rows, dtype=np.int32)
+        cols = np.asarray(cols, dtype=np.int32)
+        roles = np.asarray(roles, dtype=np.float32)
+
+        # A collaborator listed twice for a movie (e.g. director and actor) keeps only its strongest role
+        order = np.lexsort((-roles, cols, rows))
+        rows, cols, roles = rows[order], cols[order], roles[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows, cols, roles = rows[first], cols[first], roles[first]
+
+        weighting = kwargs["weighting"]
+        document_frequency = np.bincount(cols, minlength=dim)
+        idf = (np.log((1 + len(movies)) / (1 + document_frequency)) + 1.0).astype(np.float32)
+        if weighting == "binary":
+            weights = np.ones(len(rows), dtype=np.float32)
+        elif weighting == "idf":
+            weights = idf[cols]
+        else:
+            weights = idf[cols] * roles
+
+        incidence = sparse.csr_matrix((weights, (rows, cols)), shape=(len(movies), dim))
+        tqdm.write(f"[INFO] Incidence matrix has {incidence.nnz} non-zeros ({weighting} weighting).")
 
         top_k = kwargs["top_k"]
 
-        tqdm.write("[INFO] Searching for nearest neighbors...")
-        D, I = index.search(movie_vectors, top_k + 1)  # includes self
-
-        # Save recommendations
-        tqdm.write("[INFO] Delete old recommendations...")
-        MovieCollaboratorRecommendation.objects.all().delete()
+        tqdm.write("[INFO] Scoring movies that share collaborators...")
+        neighbor_indices, neighbor_scores = sparse_top_k_cosine_neighbors(
+            incidence, top_k, block_size=kwargs["block_size"]
+        )
 
         tqdm.write("[INFO] Generating recommendations for all movies...")
 
         recommendations_data = []
+        all_scores = []
         for i in range(len(movies)):
-            neighbors = I[i]
-            recommended_movie_ids = [movie_ids[nid] for nid in neighbors if nid != i][:top_k]
+            recommended_movie_ids = [movie_ids[nid] for nid in neighbor_indices[i]]
             recommendations_data.append((movies[i], recommended_movie_ids))
-
-        tqdm.write("[INFO] Creating MovieCollaboratorRecommendation instances for bulk_create...")
-        recommendations_objs = [
-            MovieCollaboratorRecommendation(movie=movie, recommended_movies=recommended_ids)
-            for movie, recommended_ids in recommendations_data
-        ]
-
-        tqdm.write("[INFO] Bulk creating recommendations in database...")
-        MovieCollaboratorRecommendation.objects.bulk_create(recommendations_objs)
+            all_scores.append(neighbor_scores[i])
+
+        output = kwargs["output"]
+        if output in ("store", "both"):
+            path = write_neighbor_store(
+                "collaborators", movie_ids, [ids for _, ids in recommendations_data], all_scores
+            )
+            tqdm.write(f"[INFO] Neighbour store written to {path}")
+        else:
+            remove_neighbor_store("collaborators")
+
+        if output in ("db", "both"):
+            # Save recommendations
+            tqdm.write("[INFO] Delete old recommendations...")
+            MovieCollaboratorRecommendation.objects.all().delete()
+
+            tqdm.write("[INFO] Creating MovieCollaboratorRecommendation instances for bulk_create...")
+            recommendations_objs = [
+                MovieCollaboratorRecommendation(movie=movie, recommended_movies=recommended_ids)
+                for movie, recommended_ids in recommendations_data
+            ]
+
+            tqdm.write("[INFO] Bulk creating recommendations in database...")
+            MovieCollaboratorRecommendation.objects.bulk_create(recommendations_objs)
+        bump_generation("collaborators")
 
         tqdm.write(f"[INFO] Collaborator-based recommendations saved successfully.")
\ No newline at end of file
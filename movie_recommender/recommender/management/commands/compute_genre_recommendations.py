@@ -1,80 +1,134 @@
 from django.core.management.base import BaseCommand
-from annoy import AnnoyIndex
 import numpy as np
 from tqdm import tqdm
 
 from recommender.models import Movie, MovieGenreRecommendation
+from algorithms.recommendation_cache import bump_generation
+from algorithms.neighbor_store import remove_neighbor_store, write_neighbor_store
+from algorithms.similarity import normalize_rows
+
+
+def bucketed_genre_neighbors(signatures, years, movie_ids, dim, top_k):
+    """
+    Exact genre neighbours computed once per pair of distinct genre signatures.
+
+    Movies with the same set of genres have identical vectors, so similarity is only computed
+    between the (few hundred) distinct signatures. Every movie then takes its neighbours from the
+    most similar signatures first; movies of equally similar signatures are ordered by release
+    year proximity and then by movie_id, which makes the result exact and reproducible.
+
+    Parameters:
+    signatures (list): Tuple of genre indices for every movie.
+    years (numpy.ndarray): Release year of every movie.
+    movie_ids (numpy.ndarray): MovieLens ID of every movie.
+    dim (int): Number of distinct genres.
+    top_k (int): Number of neighbours per movie.
+
+    Returns:
+    tuple: (neighbors, scores) lists with the recommended movie IDs and genre cosine similarities of every movie.
+    """
+    group_of_signature = {}
+    group_index = np.empty(len(signatures), dtype=np.int64)
+    for i, signature in enumerate(signatures):
+        group_index[i] = group_of_signature.setdefault(signature, len(group_of_signature))
+
+    group_vectors = np.zeros((len(group_of_signature), dim), dtype=np.float32)
+    for signature, group in group_of_signature.items():
+        group_vectors[group, list(signature)] = 1.0
+    group_vectors = normalize_rows(group_vectors)
+    group_similarity = np.round(group_vectors @ group_vectors.T, 6)
+
+    members = [np.flatnonzero(group_index == group) for group in range(len(group_of_signature))]
+    id_range = int(movie_ids.max()) + 1
+
+    neighbors = [None] * len(signatures)
+    scores = [None] * len(signatures)
+    for group in tqdm(range(len(group_of_signature)), desc="Genre signatures", unit="signature"):
+        # Tiers of candidate movies, from the most to the least similar signatures
+        similarities = group_similarity[group]
+        tiers = []
+        for similarity in np.unique(similarities)[::-1]:
+            tier_members = np.concatenate([members[other] for other in np.flatnonzero(similarities == similarity)])
+            tiers.append((float(similarity), tier_members))
+
+        for i in members[group]:
+            recommended, recommended_scores = [], []
+            for similarity, tier_members in tiers:
+                candidates = tier_members[tier_members != i]
+                if len(candidates) == 0:
+                    continue
+                need = top_k - len(recommended)
+                # Closest release year first, then lowest movie_id
+                keys = np.abs(years[candidates] - years[i]) * id_range + movie_ids[candidates]
+                if len(candidates) > need:
+                    closest = np.argpartition(keys, need - 1)[:need]
+                    candidates, keys = candidates[closest], keys[closest]
+                candidates = candidates[np.argsort(keys)]
+                recommended.extend(int(mid) for mid in movie_ids[candidates])
+                recommended_scores.extend([similarity] * len(candidates))
+                if len(recommended) >= top_k:
+                    break
+            neighbors[i] = recommended
+            scores[i] = recommended_scores
+
+    return neighbors, scores
+
 
 class Command(BaseCommand):
-    help = "Generate movie recommendations based on genre similarity using Annoy"
+    help = "Generate exact movie recommendations based on genre similarity, bucketed by genre signature"
 
     def add_arguments(self, parser):
         parser.add_argument("--top-k", type=int, default=10)
+        parser.add_argument(
+            "--output",
+            choices=["db", "store", "both"],
+            default="both",
+            help="Write recommendations to the database, the memory-mapped neighbour store, or both"
+        )
 
     def handle(self, *args, **kwargs):
         tqdm.write("[INFO] Starting Genre recommendation generation...")
 
         # Extract all genres
-        movies = list(Movie.objects.all())
+        movies = list(Movie.objects.only("movie_id", "genres", "release_year").order_by("movie_id"))
         if not movies:
             tqdm.write("[WARN] No movies found in database.")
             return
 
-        movie_id_map = {i: movie.movie_id for i, movie in enumerate(movies)}
-
         # Extract all genres
         tqdm.write(f"[INFO] Extracting Genres from {len(movies)} movies...")
-        all_genres = set()
-        for movie in movies:
-            genres = [g.strip().lower() for g in movie.genres.split(',') if g.strip()]
-            all_genres.update(genres)
-
-        genre_list = sorted(all_genres)
+        movie_genres = [
+            {g.strip().lower() for g in movie.genres.split(',') if g.strip()}
+            for movie in movies
+        ]
+        genre_list = sorted(set().union(*movie_genres))
         genre_to_idx = {genre: idx for idx, genre in enumerate(genre_list)}
         dim = len(genre_list)
         tqdm.write(f"[INFO] Total unique Genres: {dim}")
 
-        # Build movie vectors
-        def movie_to_vector(movie):
-            vec = np.zeros(dim, dtype=np.float32)
-            for genre in movie.genres.split(','):
-                genre = genre.strip().lower()
-                idx = genre_to_idx.get(genre)
-                if idx is not None:
-                    vec[idx] = 1.0
-            return vec
-
-        tqdm.write("[INFO] Vectorizing movies...")
-        movie_vectors = np.array([movie_to_vector(movie) for movie in tqdm(movies)])
-
-        # Build Annoy index
-        tqdm.write("[INFO] Building Annoy index...")
-        index = AnnoyIndex(dim, 'angular')
-        for i, vec in enumerate(movie_vectors):
-            index.add_item(i, vec.tolist())
-
-        index.build(10)
-        tqdm.write("[INFO] Annoy index built successfully.")
+        signatures = [tuple(sorted(genre_to_idx[genre] for genre in genres)) for genres in movie_genres]
+        tqdm.write(f"[INFO] Distinct genre signatures: {len(set(signatures))}")
 
-        # Save recommendations
-        tqdm.write("[INFO] Saving Genre-based recommendations to database...")
-        MovieGenreRecommendation.objects.all().delete()
+        movie_ids = np.array([movie.movie_id for movie in movies], dtype=np.int64)
+        years = np.array([movie.release_year for movie in movies], dtype=np.int64)
 
         top_k = kwargs["top_k"]
-        recommendations = []
-        for i, movie in enumerate(movies):
-            neighbor_ids = index.get_nns_by_item(i, top_k+1)
-            recommended_ids = [movie_id_map[nid] for nid in neighbor_ids if nid != i][:top_k]
-
-            recommendations.append(
-                MovieGenreRecommendation(
-                    movie=movie,
-                    recommended_movies=recommended_ids
-                )
-            )
-
-            if i % 100 == 0:
-                tqdm.write(f"[INFO] Processed {i}/{len(movies)} movies")
-
-        MovieGenreRecommendation.objects.bulk_create(recommendations)
-        tqdm.write("[INFO] Genre-based recommendations saved successfully.")
\ No newline at end of file
+        output = kwargs["output"]
+        all_recommended_ids, all_scores = bucketed_genre_neighbors(signatures, years, movie_ids, dim, top_k)
+
+        if output in ("store", "both"):
+            path = write_neighbor_store("genre", movie_ids, all_recommended_ids, all_scores)
+            tqdm.write(f"[INFO] Neighbour store written to {path}")
+        else:
+            remove_neighbor_store("genre")
+
+        if output in ("db", "both"):
+            tqdm.write("[INFO] Saving Genre-based recommendations to database...")
+            recommendations = [
+                MovieGenreRecommendation(movie=movie, recommended_movies=recommended_ids)
+                for movie, recommended_ids in zip(movies, all_recommended_ids)
+            ]
+            MovieGenreRecommendation.objects.all().delete()
+            MovieGenreRecommendation.objects.bulk_create(recommendations, batch_size=1000)
+        bump_generation("genre")
+        tqdm.write("[INFO] Genre-based recommendations saved successfully.")
@@ -1,43 +1,191 @@
 from django.core.management.base import BaseCommand
 from recommender.models import Movie, MovieImageEmbedding
 from PIL import Image
+import hashlib
 import os
+import time
 import torch
 import open_clip
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 from tqdm import tqdm
 
+MODEL_ARCH = 'ViT-B-32'
+MODEL_PRETRAINED = 'openai'
+MODEL_NAME = f"{MODEL_ARCH}/{MODEL_PRETRAINED}"
+
+
+def stat_poster(path):
+    """Returns (size, mtime_ns) of a poster file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def hash_poster(path):
+    """Returns the sha256 hex digest of a poster file, or None if it does not exist."""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
 class Command(BaseCommand):
     help = "Compute CLIP image embeddings for movies"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=64,
+            help='Number of posters encoded per forward pass'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=min(8, os.cpu_count() or 1),
+            help='Number of threads decoding and preprocessing posters'
+        )
+        parser.add_argument(
+            '--torch-threads',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of CPU threads used by torch for encoding'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-embed every poster, even if its content and the model are unchanged'
+        )
+
     def handle(self, *args, **options):
-        model, _, preprocess = open_clip.create_model_and_transforms('ViT-B-32', pretrained='openai')
-        model.eval()
+        batch_size = options['batch_size']
+        torch.set_num_threads(options['torch_threads'])
 
-        movies = list(Movie.objects.all())
+        # Only posters whose content (or the model) changed since they were embedded are processed.
+        # Files with the size and modification time recorded at their last hashing are not even read.
+        existing = {
+            movie_id: (pk, poster_hash, model_name, (poster_size, poster_mtime_ns))
+            for movie_id, pk, poster_hash, model_name, poster_size, poster_mtime_ns
+            in MovieImageEmbedding.objects.values_list(
+                "movie_id", "pk", "poster_hash", "model_name", "poster_size", "poster_mtime_ns"
+            )
+        }
+        all_movies = list(Movie.objects.only("movie_id", "title", "poster"))
+        paths = {movie.movie_id: os.path.join(settings.MEDIA_ROOT, str(movie.poster)) for movie in all_movies}
+        # Stat before hashing, so a file modified in between is hashed again on the next run
+        poster_stats = {movie_id: stat_poster(path) for movie_id, path in paths.items()}
 
-        for movie in tqdm(movies, desc="Processing movies", unit="movie"):
-            try:
-                if MovieImageEmbedding.objects.filter(movie=movie).exists():
-                    tqdm.write(f"[SKIP] {movie.title} (embedding exists)")
-                    continue
+        candidates = []
+        missing = 0
+        for movie in all_movies:
+            stat = poster_stats[movie.movie_id]
+            previous = existing.get(movie.movie_id)
+            if stat is None:
+                missing += 1
+            elif options['force'] or previous is None or (previous[2], previous[3]) != (MODEL_NAME, stat):
+                candidates.append(movie)
 
-                image_path = os.path.join(settings.MEDIA_ROOT, str(movie.poster))
-                if not os.path.exists(image_path):
-                    tqdm.write(f"[WARN] Image not found for {movie.title}")
-                    continue
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            hashes = list(tqdm(
+                executor.map(hash_poster, [paths[movie.movie_id] for movie in candidates]),
+                total=len(candidates), desc="Hashing posters", unit="poster",
+            ))
 
-                image = Image.open(image_path).convert("RGB")
-                image_input = preprocess(image).unsqueeze(0)
+        movies = []
+        poster_hashes = {}
+        touched = []
+        for movie, poster_hash in zip(candidates, hashes):
+            if poster_hash is None:
+                missing += 1
+                continue
+            previous = existing.get(movie.movie_id)
+            if not options['force'] and previous is not None and previous[1:3] == (poster_hash, MODEL_NAME):
+                # Only the modification time changed
+                size, mtime_ns = poster_stats[movie.movie_id]
+                touched.append(MovieImageEmbedding(pk=previous[0], poster_size=size, poster_mtime_ns=mtime_ns))
+                continue
+            movies.append(movie)
+            poster_hashes[movie.movie_id] = poster_hash
 
-                with torch.no_grad():
-                    embedding = model.encode_image(image_input).squeeze(0).numpy()
+        if touched:
+            MovieImageEmbedding.objects.bulk_update(touched, ["poster_size", "poster_mtime_ns"], batch_size=1000)
 
-                emb_model = MovieImageEmbedding(movie=movie)
-                emb_model.set_embedding(embedding)
-                emb_model.save()
-                tqdm.write(f"[OK] Embedded {movie.title}")
+        tqdm.write(
+            f"[INFO] {len(all_movies) - len(movies) - missing} posters unchanged, "
+            f"{len(movies)} to embed, {missing} without poster file"
+        )
+        if not movies:
+            return
 
+        model, _, preprocess = open_clip.create_model_and_transforms(MODEL_ARCH, pretrained=MODEL_PRETRAINED)
+        model.eval()
+
+        def load(movie):
+            image_path = os.path.join(settings.MEDIA_ROOT, str(movie.poster))
+            try:
+                with Image.open(image_path) as image:
+                    return movie, preprocess(image.convert("RGB")), None
             except Exception as e:
-                tqdm.write(f"[ERROR] Failed embedding for {movie.title}: {e}")
\ No newline at end of file
+                return movie, None, str(e)
+
+        batches = [movies[i:i + batch_size] for i in range(0, len(movies), batch_size)]
+        embedded = 0
+        failed = 0
+        start = time.perf_counter()
+        progress = tqdm(total=len(movies), desc="Processing movies", unit="movie")
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            # Decode the next batch in the background while the current one is encoded
+            pending = [executor.submit(load, movie) for movie in batches[0]] if batches else []
+            for b in range(len(batches)):
+                results = [future.result() for future in pending]
+                pending = [executor.submit(load, movie) for movie in batches[b + 1]] if b + 1 < len(batches) else []
+
+                loaded = []
+                for movie, tensor, error in results:
+                    if tensor is None:
+                        tqdm.write(f"[WARN] Skipping {movie.title}: {error}")
+                        failed += 1
+                    else:
+                        loaded.append((movie, tensor))
+
+                if loaded:
+                    try:
+                        with torch.inference_mode():
+                            embeddings = model.encode_image(torch.stack([tensor for _, tensor in loaded])).cpu().numpy()
+                    except Exception as e:
+                        tqdm.write(f"[ERROR] Failed embedding batch {b}: {e}")
+                        failed += len(loaded)
+                        progress.update(len(results))
+                        continue
+
+                    objs = []
+                    for (movie, _), embedding in zip(loaded, embeddings):
+                        size, mtime_ns = poster_stats[movie.movie_id]
+                        emb_model = MovieImageEmbedding(
+                            movie=movie, poster_hash=poster_hashes[movie.movie_id], model_name=MODEL_NAME,
+                            poster_size=size, poster_mtime_ns=mtime_ns,
+                        )
+                        emb_model.set_embedding(embedding)
+                        objs.append(emb_model)
+                    MovieImageEmbedding.objects.bulk_create(
+                        objs,
+                        update_conflicts=True,
+                        unique_fields=["movie"],
+                        update_fields=["embedding", "poster_hash", "model_name", "poster_size", "poster_mtime_ns"],
+                    )
+                    embedded += len(objs)
+
+                progress.update(len(results))
+
+        progress.close()
+        elapsed = time.perf_counter() - start
+        tqdm.write(
+            f"[DONE] Embedded {embedded} posters in {elapsed:.1f}s "
+            f"({embedded / elapsed if elapsed else 0:.1f} posters/sec), failed: {failed}"
+        )
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from tqdm import tqdm
+import os
+
+from algorithms.algorithm_tag import TagRecommender
+from algorithms.recommendation_cache import bump_generation
+from algorithms.neighbor_store import remove_neighbor_store, write_neighbor_store
+from recommender.models import Movie, MovieTagRecommendation
+
+
+class Command(BaseCommand):
+    help = "Generate movie recommendations based on tag genome similarity"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top-k", type=int, default=10)
+        parser.add_argument(
+            "--block-size",
+            type=int,
+            default=1024,
+            help="Number of movies whose similarities are computed at once (bounds peak memory)"
+        )
+        parser.add_argument(
+            "--output",
+            choices=["db", "store", "both"],
+            default="both",
+            help="Write recommendations to the database, the memory-mapped neighbour store, or both"
+        )
+
+    def handle(self, *args, **kwargs):
+        tqdm.write("[INFO] Starting Tag recommendation generation...")
+
+        movie_ids = set(Movie.objects.values_list("movie_id", flat=True))
+        if not movie_ids:
+            tqdm.write("[WARN] No movies found in database.")
+            return
+
+        this_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+        data_dir = os.path.abspath(os.path.join(this_dir, "datasets", "ml-20m"))
+
+        top_k = kwargs["top_k"]
+        recommender = TagRecommender(data_dir, top_k=top_k, block_size=kwargs["block_size"], movie_ids=movie_ids)
+
+        recommended_ids = recommender.movie_ids[recommender.neighbor_indices]
+
+        if kwargs["output"] in ("store", "both"):
+            path = write_neighbor_store("tag", recommender.movie_ids, recommended_ids, recommender.neighbor_scores)
+            tqdm.write(f"[INFO] Neighbour store written to {path}")
+        else:
+            remove_neighbor_store("tag")
+
+        if kwargs["output"] in ("db", "both"):
+            tqdm.write("[INFO] Saving Tag-based recommendations to database...")
+            MovieTagRecommendation.objects.all().delete()
+
+            recommendations = [
+                MovieTagRecommendation(movie_id=int(movie_id), recommended_movies=neighbors.tolist())
+                for movie_id, neighbors in zip(recommender.movie_ids, recommended_ids)
+            ]
+            MovieTagRecommendation.objects.bulk_create(recommendations, batch_size=1000)
+
+        bump_generation("tag")
+        tqdm.write(f"[INFO] Tag-based recommendations saved successfully for {len(recommender.movie_ids)} movies.")
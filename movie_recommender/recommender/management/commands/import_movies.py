@@ -1,15 +1,109 @@
 import os
 import json
+import hashlib
+import multiprocessing
+import queue
+import shutil
+import threading
+import time
+from functools import partial
+import django
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.core.files import File
-from recommender.models import Movie
-from duckduckgo_search import DDGS
-from PIL import Image
-import requests
-from io import BytesIO
-from django.core.files.base import ContentFile
+from django.db import OperationalError, connection, transaction
+from recommender.models import Movie, MovieImportRecord
+from algorithms.recommendation_cache import MOVIES_GENERATION, bump_generation
+from algorithms.import_changeset import write_changeset
+from algorithms.neighbor_store import remove_all_neighbor_stores
+from algorithms.poster_fetcher import PosterFetcher
+from algorithms.poster_images import POSTER_SIZE, resize_poster
+from algorithms.title_search import rebuild_title_index, title_index_exists
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+
+MOVIE_FIELDS = ["title", "overview", "release_year", "actors", "genres", "directors", "poster"]
+
+
+def get_list(value):
+    if isinstance(value, list):
+        return ", ".join(value)
+    elif isinstance(value, str):
+        return value
+    return ""
+
+def parse_actors(actors_field):
+    if not actors_field:
+        return ""
+    actors = actors_field[0] if isinstance(actors_field, list) else actors_field
+    return actors.replace("Stars:", "").split("|")[0].strip()
+
+def copy_poster(source_path, name, media_root):
+    """
+    Copies a poster into the media directory under the given storage name, unless an identical
+    copy is already there (compared by size and modification time), and returns the name.
+    """
+    target_path = os.path.join(media_root, name)
+    try:
+        target = os.stat(target_path)
+        source = os.stat(source_path)
+        if (target.st_size, target.st_mtime_ns) == (source.st_size, source.st_mtime_ns):
+            return name
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    shutil.copy2(source_path, target_path)
+    return name
+
+def get_mtime_ns(path):
+    """Returns the modification time of a file in nanoseconds, or 0 if it does not exist."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def parse_movie_file(file_path, poster_dir, media_root):
+    """
+    Parses one movie information file and copies the movie's poster into the media directory.
+
+    Returns:
+    tuple: (fields, content_hash, error). fields holds the Movie field values, with poster set to the
+    stored poster name, or "" if the dataset has no poster for the movie. content_hash is the sha256
+    of the file. fields is None if the file was skipped, in which case error describes the failure
+    (or is None for files without a movie ID).
+    """
+    try:
+        with open(file_path, "rb") as f:
+            content = f.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        data = json.loads(content.decode("utf-8"))
+    except (OSError, ValueError) as e:
+        return None, None, f"Failed to parse {os.path.basename(file_path)}: {e}"
+
+    movie_data = data.get("movielens", {})
+    tmdb_data = data.get("tmdb", {})
+    imdb_data = data.get("imdb", {})
+
+    movie_id = movie_data.get("movieId")
+    if not movie_id:
+        return None, content_hash, None
+
+    fields = {
+        "movie_id": movie_id,
+        "title": movie_data.get("title", ""),
+        "overview": tmdb_data.get("overview", ""),
+        "release_year": int(movie_data.get("releaseYear", 0) or 0),
+        "actors": parse_actors(imdb_data.get("actors")),
+        "genres": get_list(movie_data.get("genres")),
+        "directors": get_list(imdb_data.get("directors")),
+        "poster": "",
+    }
+    poster_path = os.path.join(poster_dir, f"{movie_id}.jpg")
+    if os.path.exists(poster_path):
+        try:
+            fields["poster"] = copy_poster(poster_path, f"posters/{movie_id}.jpg", media_root)
+        except OSError as e:
+            return None, content_hash, f"Failed to copy poster of movie {movie_id}: {e}"
+    return fields, content_hash, None
 
 class Command(BaseCommand):
     help = "Import movie data and posters from JSON files"
@@ -31,6 +125,126 @@ class Command(BaseCommand):
             action='store_true',
             help='Attempt to fetch missing posters from TMDB or DuckDuckGo'
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=min(8, os.cpu_count() or 1),
+            help='Number of processes parsing movie files and copying posters'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of movies per bulk insert statement'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Re-parse every information file, even if the import manifest says it is unchanged'
+        )
+
+    def fetch_posters(self, fallback_path, workers, batch_size):
+        """
+        Fetches the posters of self.missing_movies from the web and stores them without re-saving the rows.
+
+        Fetch threads feed the downloaded bytes to a process pool that decodes and resizes them;
+        a single writer thread assigns the posters in batched bulk updates, so SQLite only ever
+        sees one writer.
+
+        Notes:
+        The resize pool is created before any thread starts and its workers come from a forkserver,
+        so they are never forked from a process whose writer or connection pool threads hold locks.
+        resize_poster lives in a Django-free module, so the workers need no django.setup().
+        """
+        tqdm.write(f"[INFO] Fetching {len(self.missing_movies)} web posters...")
+        updates = queue.Queue()
+        stats = {"fetched": 0, "bytes": 0}
+        # Only touched by the writer thread, merged into stats after it has been joined
+        writer_stats = {"fallback": 0, "lock_errors": 0}
+        writer_errors = []
+
+        def write_batch(batch):
+            for attempt in range(5):
+                try:
+                    Movie.objects.bulk_update(batch, ["poster"])
+                    return
+                except OperationalError as e:
+                    if "locked" not in str(e) or attempt == 4:
+                        raise
+                    writer_stats["lock_errors"] += 1
+                    time.sleep(0.5 * 2 ** attempt)
+
+        def writer():
+            batch = []
+            try:
+                while True:
+                    item = updates.get()
+                    # After a failure the queue is still drained, so producers never wait on a dead writer
+                    if not writer_errors:
+                        try:
+                            if item is not None:
+                                movie_id, name = item
+                                if name is None:
+                                    writer_stats["fallback"] += 1
+                                    name = copy_poster(
+                                        fallback_path, f"posters/0_{movie_id}.png", settings.MEDIA_ROOT
+                                    )
+                                batch.append(Movie(movie_id=movie_id, poster=name))
+                            if batch and (item is None or len(batch) >= batch_size):
+                                write_batch(batch)
+                                batch = []
+                        except Exception as e:
+                            writer_errors.append(e)
+                    if item is None:
+                        return
+            finally:
+                connection.close()
+
+        def resized(movie_id, title, name, future):
+            error = future.exception()
+            if error is not None:
+                tqdm.write(f"[WARN] Invalid poster image for '{title}': {error}")
+                name = None
+            updates.put((movie_id, name))
+
+        start = time.perf_counter()
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("forkserver")
+        )
+        writer_thread = threading.Thread(target=writer, name="poster-writer")
+        writer_thread.start()
+        try:
+            # The pool shuts down (waiting for every resize callback) before the writer is told to stop
+            with executor, PosterFetcher(api_key=os.getenv("TMDB_API_KEY")) as fetcher:
+                results = fetcher.fetch_all(self.missing_movies)
+                for movie_id, title, content, source in tqdm(
+                    results, total=len(self.missing_movies), desc="Downloading posters", unit="img"
+                ):
+                    if writer_errors:
+                        # Nothing fetched from here on could be stored
+                        results.close()
+                        break
+                    if content is None:
+                        updates.put((movie_id, None))
+                        continue
+                    stats["fetched"] += 1
+                    stats["bytes"] += len(content)
+                    name = f"posters/{source}_{movie_id}.jpg"
+                    future = executor.submit(resize_poster, content, os.path.join(settings.MEDIA_ROOT, name))
+                    future.add_done_callback(partial(resized, movie_id, title, name))
+        finally:
+            updates.put(None)
+            writer_thread.join()
+        if writer_errors:
+            raise writer_errors[0]
+        stats.update(writer_stats)
+
+        elapsed = time.perf_counter() - start
+        tqdm.write(
+            f"[INFO] Fetched {stats['fetched']} posters ({stats['bytes'] / 1e6:.1f} MB) in {elapsed:.1f}s "
+            f"({len(self.missing_movies) / elapsed if elapsed else 0:.1f} movies/sec), "
+            f"{stats['fallback']} use the fallback, {stats['lock_errors']} database lock errors"
+        )
 
     def handle(self, *args, **options):
         self.missing_movies = []
@@ -43,168 +257,147 @@ class Command(BaseCommand):
             confirm = input("Are you sure you want to delete all existing movies? Type 'yes' to continue: ")
             if confirm.lower() == 'yes':
                 Movie.objects.all().delete()
+                remove_all_neighbor_stores()
                 self.stdout.write(self.style.WARNING("Deleted all existing movies."))
             else:
                 self.stdout.write(self.style.WARNING("Aborted movie deletion."))
 
-        files = [f for f in os.listdir(info_dir) if f.endswith(".json")]
-        for filename in tqdm(files, desc="Importing movies", unit="file"):
-            file_path = os.path.join(info_dir, filename)
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-            except json.JSONDecodeError:
-                self.stderr.write(f"[ERROR] Failed to parse {filename}")
-                continue
-
-            movie_data = data.get("movielens", {})
-            tmdb_data = data.get("tmdb", {})
-            imdb_data = data.get("imdb", {})
-
-            movie_id = movie_data.get("movieId")
-            if not movie_id:
-                continue
-
-            title = movie_data.get("title", "")
-            release_year = int(movie_data.get("releaseYear", 0) or 0)
-            genres = self.get_list(movie_data.get("genres"))
-            overview = tmdb_data.get("overview", "")
-            directors = self.get_list(imdb_data.get("directors"))
-            actors = self.parse_actors(imdb_data.get("actors"))
+        # Posters already stored for existing movies (e.g. fetched from the web) are kept,
+        # fallback posters only if no fetch is requested
+        existing_posters = {
+            movie_id: poster for movie_id, poster in Movie.objects.values_list("movie_id", "poster")
+            if poster and not (options['fetch_posters'] and os.path.basename(poster).startswith("0_"))
+        }
+        existing_ids = set(Movie.objects.values_list("movie_id", flat=True))
+        records = {record.file_name: record for record in MovieImportRecord.objects.all()}
 
-            try:
-                movie, _ = Movie.objects.get_or_create(
-                    movie_id=movie_id,
-                    defaults={
-                        "title": title,
-                        "overview": overview,
-                        "release_year": release_year,
-                        "actors": actors,
-                        "genres": genres,
-                        "directors": directors,
-                    }
-                )
-            except Exception as e:
-                self.stderr.write(f"[ERROR] Failed to create movie {movie_id}: {e}")
-                continue
-
-            poster_path = os.path.join(poster_dir, f"{movie_id}.jpg")
-            if os.path.exists(poster_path):
-                with open(poster_path, 'rb') as f:
-                    movie.poster.save(f"{movie_id}.jpg", File(f), save=False)
+        # Files whose information file and poster are untouched since the last import are skipped without reading them
+        filenames = sorted(f for f in os.listdir(info_dir) if f.endswith(".json"))
+        to_parse = []
+        unchanged = 0
+        for filename in filenames:
+            record = records.get(filename)
+            if (
+                not options['full']
+                and record is not None
+                and record.mtime_ns == get_mtime_ns(os.path.join(info_dir, filename))
+                and record.poster_mtime_ns == get_mtime_ns(os.path.join(poster_dir, f"{record.movie_id}.jpg"))
+            ):
+                unchanged += 1
             else:
-                self.missing_movies.append((movie.pk, title))
-
-            movie.save()
-            self.stdout.write(f"[OK] Imported: {title} ({movie_id})")
-
-        if self.missing_movies:
-            if options['fetch_posters']:
-                print(f"[INFO] Fetching {len(self.missing_movies)} web posters in background threads...")
-                with ThreadPoolExecutor(max_workers=8) as executor:
-                    futures = [
-                        executor.submit(fetch_and_save_poster, movie_id, title, fallback_path)
-                        for movie_id, title in self.missing_movies
-                    ]
-                    for future in tqdm(futures, desc="Downloading posters", unit="img"):
-                        try:
-                            future.result()
-                        except Exception as e:
-                            print(f"[ERROR] Threaded download failed: {e}")
-            else:
-                for movie_id, _ in self.missing_movies:
-                    movie = Movie.objects.get(pk=movie_id)
-                    with open(fallback_path, 'rb') as f:
-                        movie.poster.save(f"0_{movie_id}.png", File(f), save=True)
+                to_parse.append(filename)
+        tqdm.write(f"[INFO] {unchanged} movie files unchanged, {len(to_parse)} to import")
 
-        self.stdout.write(self.style.SUCCESS("🎉 Import complete."))
+        parse = partial(parse_movie_file, poster_dir=poster_dir, media_root=settings.MEDIA_ROOT)
+        paths = [os.path.join(info_dir, filename) for filename in to_parse]
+        movies = {}
+        new_records = []
+        touched = []
+        # Movie ID each current information file describes after this import
+        file_movie_ids = {filename: record.movie_id for filename, record in records.items()}
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            results = executor.map(parse, paths, chunksize=64)
+            for filename, path, (fields, content_hash, error) in zip(
+                to_parse, paths, tqdm(results, total=len(paths), desc="Importing movies", unit="file")
+            ):
+                if error:
+                    tqdm.write(f"[ERROR] {error}")
+                if fields is None or fields["movie_id"] in movies:
+                    continue
 
-    def get_list(self, value):
-        if isinstance(value, list):
-            return ", ".join(value)
-        elif isinstance(value, str):
-            return value
-        return ""
+                movie_id = fields["movie_id"]
+                file_movie_ids[filename] = movie_id
+                record = MovieImportRecord(
+                    file_name=filename,
+                    movie_id=movie_id,
+                    mtime_ns=get_mtime_ns(path),
+                    poster_mtime_ns=get_mtime_ns(os.path.join(poster_dir, f"{movie_id}.jpg")),
+                    content_hash=content_hash,
+                )
+                previous = records.get(filename)
+                if (
+                    not options['full']
+                    and previous is not None
+                    and movie_id in existing_ids
+                    and (previous.movie_id, previous.content_hash, previous.poster_mtime_ns)
+                    == (movie_id, content_hash, record.poster_mtime_ns)
+                ):
+                    # Only the modification time changed
+                    touched.append(record)
+                    continue
 
-    def parse_actors(self, actors_field):
-        if not actors_field:
-            return ""
-        actors = actors_field[0] if isinstance(actors_field, list) else actors_field
-        return actors.replace("Stars:", "").split("|")[0].strip()
-    
-
-def fetch_tmdb_poster(title, api_key):
-    url = "https://api.themoviedb.org/3/search/movie"
-    params = {"api_key": api_key, "query": title}
-    resp = requests.get(url, params=params)
-    data = resp.json()
-    
-    if data['results']:
-        poster_path = data['results'][0].get('poster_path')
-        if poster_path:
-            return f"https://image.tmdb.org/t/p/w500{poster_path}"
-    return None
-    
-def fetch_online_poster(movie_title):
-    from urllib.parse import quote
+                if not fields["poster"]:
+                    if movie_id in existing_posters:
+                        fields["poster"] = existing_posters[movie_id]
+                    else:
+                        self.missing_movies.append((movie_id, fields["title"]))
+                        if not options['fetch_posters']:
+                            fields["poster"] = copy_poster(
+                                fallback_path, f"posters/0_{movie_id}.png", settings.MEDIA_ROOT
+                            )
+                movies[movie_id] = Movie(**fields)
+                new_records.append(record)
 
-    try:
-        with DDGS() as ddgs:
-            queries = [f"{movie_title} movie poster", movie_title]
+        # Movies whose information file disappeared, or now describes another movie ID, are removed
+        # (with their recommendations)
+        current_files = set(filenames)
+        imported_ids = set(movies)
+        stale_files = [filename for filename in records if filename not in current_files]
+        kept_ids = imported_ids | {
+            movie_id for filename, movie_id in file_movie_ids.items() if filename in current_files
+        }
+        removed = {record.movie_id for record in records.values()} - kept_ids
 
-            for query in queries:
-                try:
-                    results = ddgs.images(query, max_results=1, safesearch="off")
-                    result = results[0] if results else None
-
-                    if result and 'image' in result:
-                        image_url = result['image']
-                        response = requests.get(image_url, timeout=10)
-                        response.raise_for_status()
-                        image = Image.open(BytesIO(response.content)).convert("RGB")
-                        image = image.resize((500, 750))
-                        return image
-                    else:
-                        print(f"[DEBUG] No image found for query: '{query}'")
-                except Exception as inner_e:
-                    print(f"[ERROR] Query failed for '{query}': {inner_e}")
-                    continue
+        with transaction.atomic():
+            Movie.objects.bulk_create(
+                movies.values(),
+                batch_size=options['batch_size'],
+                update_conflicts=True,
+                unique_fields=["movie_id"],
+                update_fields=MOVIE_FIELDS,
+            )
+            MovieImportRecord.objects.bulk_create(
+                new_records + touched,
+                batch_size=options['batch_size'],
+                update_conflicts=True,
+                unique_fields=["file_name"],
+                update_fields=["movie", "mtime_ns", "poster_mtime_ns", "content_hash"],
+            )
+            for i in range(0, len(stale_files), 900):
+                MovieImportRecord.objects.filter(file_name__in=stale_files[i:i + 900]).delete()
+            removed_ids = list(removed)
+            for i in range(0, len(removed_ids), 900):
+                Movie.objects.filter(movie_id__in=removed_ids[i:i + 900]).delete()
 
-    except Exception as e:
-        print(f"[WARN] Failed DuckDuckGo session for '{movie_title}': {e}")
+        changeset = write_changeset(
+            added=imported_ids - existing_ids,
+            updated=imported_ids & existing_ids,
+            removed=removed,
+        )
+        elapsed = time.perf_counter() - start
+        tqdm.write(
+            f"[INFO] Imported {len(movies)} movies in {elapsed:.1f}s "
+            f"({len(movies) / elapsed if elapsed else 0:.0f} movies/sec), {len(self.missing_movies)} without poster"
+        )
+        tqdm.write(
+            f"[INFO] Changeset: {len(changeset['added'])} added, {len(changeset['updated'])} updated, "
+            f"{len(changeset['removed'])} removed"
+        )
 
-    return None
-    
-def fetch_and_save_poster(movie_id, title, fallback_path):
-    import time
-    from recommender.models import Movie
+        if self.missing_movies and options['fetch_posters']:
+            self.fetch_posters(fallback_path, options['workers'], options['batch_size'])
 
-    TMDB_API_KEY = os.getenv("TMDB_API_KEY")
-    movie = Movie.objects.get(pk=movie_id)
+        # Stores would keep serving deleted (or, after --full, possibly stale) movies until rebuilt
+        if removed or (options['full'] and movies):
+            stores = remove_all_neighbor_stores()
+            if stores:
+                tqdm.write(f"[INFO] Removed neighbour stores of {', '.join(sorted(stores))} until they are rebuilt")
 
-    poster_url = fetch_tmdb_poster(title, TMDB_API_KEY)
-    if poster_url:
-        try:
-            response = requests.get(poster_url, timeout=10)
-            response.raise_for_status()
-            image = Image.open(BytesIO(response.content)).convert("RGB")
-            image = image.resize((500, 750))
-            buffer = BytesIO()
-            image.save(buffer, format='JPEG')
-            movie.poster.save(f"tmdb_{movie_id}.jpg", ContentFile(buffer.getvalue()), save=True)
-            print(f"[THREAD] TMDB poster fetched for {title}")
-            return
-        except Exception as e:
-            print(f"[WARN] TMDB fetch failed for '{title}': {e}")
-
-    time.sleep(2)
-    image = fetch_online_poster(title)
-    if image:
-        buffer = BytesIO()
-        image.save(buffer, format='JPEG')
-        movie.poster.save(f"web_{movie_id}.jpg", ContentFile(buffer.getvalue()), save=True)
-        print(f"[THREAD] DuckDuckGo poster fetched for {title}")
-    else:
-        with open(fallback_path, 'rb') as f:
-            movie.poster.save(f"0_{movie_id}.png", File(f), save=False)
-        print(f"[THREAD] Using fallback for '{title}'")
+        if movies or removed or not title_index_exists():
+            indexed = rebuild_title_index()
+            if indexed is not None:
+                tqdm.write(f"[INFO] Title search index rebuilt with {indexed} movies")
+        if movies or removed:
+            bump_generation(MOVIES_GENERATION)
+        self.stdout.write(self.style.SUCCESS("🎉 Import complete."))
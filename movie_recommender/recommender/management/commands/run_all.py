@@ -1,5 +1,60 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.core.management import call_command
+from django.conf import settings
+from django.db import connections
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from collections import namedtuple
+from datetime import datetime
+import django
+import json
+import os
+import time
+
+from algorithms.import_changeset import is_unchanged, load_changeset
+from recommender.models import (
+    Movie, MovieCollaboratorRecommendation, MovieGenreRecommendation, MovieImageEmbedding,
+    MovieImageRecommendation, MoviePlotRecommendation, MovieTagRecommendation,
+)
+
+Stage = namedtuple("Stage", ["name", "command", "kwargs", "dependencies", "model"])
+
+# The pipeline as a dependency graph: every stage only waits for the stages it reads from
+STAGES = [
+    Stage("import", "import_movies", {}, [], Movie),
+    Stage("embeddings", "compute_image_embeddings", {}, ["import"], MovieImageEmbedding),
+    Stage("image", "build_image_recommendations", {"top_k": 5}, ["embeddings"], MovieImageRecommendation),
+    Stage("genre", "compute_genre_recommendations", {"top_k": 5}, ["import"], MovieGenreRecommendation),
+    Stage(
+        "collaborator", "compute_collaborator_recommendations", {"top_k": 5, "weighting": "idf-billing"}, ["import"],
+        MovieCollaboratorRecommendation,
+    ),
+    Stage("plot", "build_plot_recommendations", {"top_k": 5}, ["import"], MoviePlotRecommendation),
+    Stage("tag", "compute_tag_recommendations", {"top_k": 5}, ["import"], MovieTagRecommendation),
+]
+STAGE_NAMES = [stage.name for stage in STAGES]
+
+
+def run_stage(command, kwargs):
+    """Runs one stage's management command in a worker process and returns its wall-clock time."""
+    start = time.perf_counter()
+    call_command(command, **kwargs)
+    return time.perf_counter() - start
+
+
+def load_state():
+    try:
+        with open(settings.PIPELINE_STATE_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    tmp_path = f"{settings.PIPELINE_STATE_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, settings.PIPELINE_STATE_PATH)
+
 
 class Command(BaseCommand):
     help = "Runs all preprocessing steps: embeddings and recommendations"
@@ -10,36 +65,142 @@ class Command(BaseCommand):
             action='store_true',
             help='Attempt to fetch posters during movie import'
         )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Recompute embeddings and recommendations even if the import changed no movies'
+        )
+        parser.add_argument(
+            '--only',
+            nargs='+',
+            choices=STAGE_NAMES,
+            help='Run only these stages (their dependencies are assumed to be up to date)'
+        )
+        parser.add_argument(
+            '--skip',
+            nargs='+',
+            choices=STAGE_NAMES,
+            default=[],
+            help='Do not run these stages'
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Skip the stages that succeeded in the previous run'
+        )
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            default=4,
+            help='Maximum number of stages running in parallel processes'
+        )
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.NOTICE("Starting full preprocessing pipeline..."))
 
-        try:
-            self.stdout.write(self.style.NOTICE("Importing movies (with --clear)..."))
-            call_command("import_movies", clear=True, fetch_posters=options['fetch_posters'])
-            self.stdout.write(self.style.SUCCESS("Movies imported."))
+        selected = [
+            stage for stage in STAGES
+            if (options['only'] is None or stage.name in options['only']) and stage.name not in options['skip']
+        ]
+        saved = load_state()
+        previous = saved.get("stages", {}) if options['resume'] else {}
+        # Stages whose output may be stale because they failed, were blocked or never finished
+        stale = set(saved.get("dirty", [])) | {
+            name for name, result in saved.get("stages", {}).items() if result.get("status") in ("failed", "blocked")
+        }
+        state = {"started_at": datetime.now().isoformat(timespec="seconds"), "stages": {}}
+        results = state["stages"]
+        for stage in selected:
+            if previous.get(stage.name, {}).get("status") == "ok":
+                results[stage.name] = {**previous[stage.name], "status": "ok", "resumed": True}
+
+        kwargs = {stage.name: dict(stage.kwargs) for stage in selected}
+        if "import" in kwargs:
+            kwargs["import"]["fetch_posters"] = options['fetch_posters']
 
-            self.stdout.write(self.style.NOTICE("Computing image embeddings."))
-            call_command("compute_image_embeddings")
-            self.stdout.write(self.style.SUCCESS("Embeddings complete."))
+        # Unselected dependencies count as done
+        selected_names = {stage.name for stage in selected}
+        done = {name for name in STAGE_NAMES if name not in selected_names} | {
+            name for name, result in results.items() if result["status"] == "ok"
+        }
+        pending = [stage for stage in selected if stage.name not in done]
+        dirty = stale | {stage.name for stage in pending}
+        state["dirty"] = sorted(dirty)
+        save_state(state)
+        running = {}
+        start = time.perf_counter()
 
-            self.stdout.write(self.style.NOTICE("Computing image-based recommendations."))
-            call_command("build_image_recommendations", top_k=5, num_trees=1000)
-            self.stdout.write(self.style.SUCCESS("Recommendations complete."))
+        # Child processes must open their own database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=max(1, options['jobs']), initializer=django.setup) as executor:
+            while pending or running:
+                for stage in list(pending):
+                    if any(results.get(dep, {}).get("status") in ("failed", "blocked") for dep in stage.dependencies):
+                        results[stage.name] = {"status": "blocked"}
+                        pending.remove(stage)
+                    elif all(dep in done for dep in stage.dependencies):
+                        self.stdout.write(self.style.NOTICE(f"[START] {stage.name} ({stage.command})"))
+                        running[executor.submit(run_stage, stage.command, kwargs[stage.name])] = stage
+                        pending.remove(stage)
+                if not running:
+                    break
 
-            self.stdout.write(self.style.NOTICE("Computing genre-based recommendations."))
-            call_command("compute_genre_recommendations", top_k=5)
-            self.stdout.write(self.style.SUCCESS("Recommendations complete."))
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    try:
+                        seconds = future.result()
+                    except Exception as e:
+                        results[stage.name] = {"status": "failed", "error": str(e)}
+                        self.stderr.write(self.style.ERROR(f"[FAIL] {stage.name}: {e}"))
+                    else:
+                        results[stage.name] = {
+                            "status": "ok",
+                            "seconds": round(seconds, 2),
+                            "rows": stage.model.objects.count(),
+                            "finished_at": datetime.now().isoformat(timespec="seconds"),
+                        }
+                        done.add(stage.name)
+                        dirty.discard(stage.name)
+                        self.stdout.write(self.style.SUCCESS(f"[DONE] {stage.name} in {seconds:.1f}s"))
 
-            self.stdout.write(self.style.NOTICE("Computing collaborator-based recommendations."))
-            call_command("compute_collaborator_recommendations", top_k=5)
-            self.stdout.write(self.style.SUCCESS("Recommendations complete."))
+                        if stage.name == "import" and is_unchanged(load_changeset()) and not options['force']:
+                            # Stages left dirty by an earlier run, and the stages reading from them, still have to run
+                            rerun = set(stale)
+                            for candidate in pending:
+                                if any(dep in rerun for dep in candidate.dependencies):
+                                    rerun.add(candidate.name)
+                            skipped = [stage for stage in pending if stage.name not in rerun]
+                            pending = [stage for stage in pending if stage.name in rerun]
+                            for unchanged_stage in skipped:
+                                results[unchanged_stage.name] = {"status": "unchanged"}
+                                done.add(unchanged_stage.name)
+                                dirty.discard(unchanged_stage.name)
+                            if pending:
+                                self.stdout.write(self.style.NOTICE(
+                                    f"No movies changed, rerunning stages left unfinished: "
+                                    f"{', '.join(stage.name for stage in pending)}"
+                                ))
+                            else:
+                                self.stdout.write(self.style.SUCCESS("No movies changed, recommendations are up to date."))
+                    state["dirty"] = sorted(dirty)
+                    save_state(state)
 
-            self.stdout.write(self.style.NOTICE("Computing plot-based recommendations."))
-            call_command("build_plot_recommendations", top_k=5)
-            self.stdout.write(self.style.SUCCESS("Recommendations complete."))
+        state["seconds"] = round(time.perf_counter() - start, 2)
+        save_state(state)
+        self.report(selected, results, state["seconds"])
 
-            self.stdout.write(self.style.SUCCESS("Preprocessing finished."))
+        failed = [name for name, result in results.items() if result["status"] in ("failed", "blocked")]
+        if failed:
+            raise CommandError(f"Preprocessing failed: {', '.join(failed)} (rerun with --resume to continue)")
+        self.stdout.write(self.style.SUCCESS("Preprocessing finished."))
 
-        except CommandError as e:
-            self.stderr.write(self.style.ERROR(f"[FAIL] Preprocessing failed: {e}"))
\ No newline at end of file
+    def report(self, stages, results, total_seconds):
+        self.stdout.write(f"{'Stage':<14}{'Status':<11}{'Seconds':>9}{'Rows':>10}")
+        for stage in stages:
+            result = results.get(stage.name, {})
+            status = "resumed" if result.get("resumed") else result.get("status", "-")
+            seconds = f"{result['seconds']:.1f}" if "seconds" in result else "-"
+            rows = result.get("rows", "-")
+            self.stdout.write(f"{stage.name:<14}{status:<11}{seconds:>9}{rows:>10}")
+        self.stdout.write(f"Pipeline wall-clock: {total_seconds:.1f}s (report in {settings.PIPELINE_STATE_PATH})")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+import time
+
+from algorithms.movie_recommender import get_import_report
+
+
+class Command(BaseCommand):
+    help = "Import every recommendation strategy and report how long each module took to load"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        report = get_import_report(load_all=True)
+        total = time.perf_counter() - start
+
+        self.stdout.write(f"{'ID':<4}{'Strategy':<16}{'Module':<28}{'Import (s)':>10}")
+        for function_id, name, module, seconds in report:
+            self.stdout.write(f"{function_id:<4}{name:<16}{module:<28}{seconds:>10.3f}")
+        self.stdout.write(self.style.SUCCESS(f"All strategies loaded in {total:.3f}s"))
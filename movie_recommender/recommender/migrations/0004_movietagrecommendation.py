@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommender", "0003_moviecollaboratorrecommendation_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MovieTagRecommendation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("recommended_movies", models.JSONField()),
+                (
+                    "movie",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="tag_recommendations",
+                        to="recommender.movie",
+                    ),
+                ),
+            ],
+        ),
+    ]
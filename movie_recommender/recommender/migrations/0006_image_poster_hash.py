@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommender", "0005_strategygeneration"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="movieimageembedding",
+            name="model_name",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+        migrations.AddField(
+            model_name="movieimageembedding",
+            name="poster_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddField(
+            model_name="movieimagerecommendation",
+            name="poster_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommender", "0006_image_poster_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MovieImportRecord",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("file_name", models.CharField(max_length=255, unique=True)),
+                ("mtime_ns", models.BigIntegerField()),
+                ("poster_mtime_ns", models.BigIntegerField(default=0)),
+                ("content_hash", models.CharField(max_length=64)),
+                (
+                    "movie",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="import_records",
+                        to="recommender.movie",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommender", "0007_movieimportrecord"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="movieimageembedding",
+            name="poster_mtime_ns",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="movieimageembedding",
+            name="poster_size",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
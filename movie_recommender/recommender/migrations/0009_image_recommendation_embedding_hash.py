@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommender", "0008_image_poster_stat"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="movieimagerecommendation",
+            name="embedding_hash",
+            field=models.CharField(blank=True, default="", max_length=40),
+        ),
+    ]
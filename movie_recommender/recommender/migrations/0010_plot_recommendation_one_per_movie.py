@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def remove_duplicate_rows(apps, schema_editor):
+    """Keeps the first plot recommendation row of every movie, so the column can become unique."""
+    MoviePlotRecommendation = apps.get_model("recommender", "MoviePlotRecommendation")
+    seen = set()
+    duplicates = []
+    for pk, movie_id in MoviePlotRecommendation.objects.order_by("pk").values_list("pk", "movie_id"):
+        if movie_id in seen:
+            duplicates.append(pk)
+        seen.add(movie_id)
+    for i in range(0, len(duplicates), 900):
+        MoviePlotRecommendation.objects.filter(pk__in=duplicates[i:i + 900]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommender", "0009_image_recommendation_embedding_hash"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_rows, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="movieplotrecommendation",
+            name="movie",
+            field=models.OneToOneField(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="plot_recommendations",
+                to="recommender.movie",
+            ),
+        ),
+    ]
@@ -15,6 +15,11 @@ class Movie(models.Model):
 class MovieImageEmbedding(models.Model):
     movie = models.OneToOneField(Movie, on_delete=models.CASCADE, related_name="image_embedding")
     embedding = models.BinaryField()
+    poster_hash = models.CharField(max_length=64, blank=True, default="")
+    model_name = models.CharField(max_length=100, blank=True, default="")
+    # Size and modification time of the poster file when it was hashed, to skip unchanged files without reading them
+    poster_size = models.BigIntegerField(default=0)
+    poster_mtime_ns = models.BigIntegerField(default=0)
 
     def set_embedding(self, vector):
         self.embedding = np.asarray(vector, dtype=np.float32).tobytes()
@@ -25,6 +30,9 @@ class MovieImageEmbedding(models.Model):
 class MovieImageRecommendation(models.Model):
     movie = models.OneToOneField(Movie, on_delete=models.CASCADE, related_name="image_recommendations")
     recommended_movies = models.JSONField()
+    # poster_hash and sha1 of the raw vector of the movie's embedding when these recommendations were computed
+    poster_hash = models.CharField(max_length=64, blank=True, default="")
+    embedding_hash = models.CharField(max_length=40, blank=True, default="")
 
 class MovieGenreRecommendation(models.Model):
     movie = models.ForeignKey("Movie", on_delete=models.CASCADE, related_name="genre_recommendations")
@@ -35,10 +43,34 @@ class MovieCollaboratorRecommendation(models.Model):
     recommended_movies = models.JSONField()
 
 class MoviePlotRecommendation(models.Model):
-    movie = models.ForeignKey("Movie", on_delete=models.CASCADE, related_name="plot_recommendations")
+    movie = models.OneToOneField("Movie", on_delete=models.CASCADE, related_name="plot_recommendations")
     recommended_movies = models.JSONField()
 
 class MovieLdaEmbedding(models.Model):
     movie = models.OneToOneField(Movie, on_delete=models.CASCADE, related_name="lda_embedding")
     embedding = models.BinaryField()
 
+    def set_embedding(self, vector):
+        self.embedding = np.asarray(vector, dtype=np.float32).tobytes()
+
+    def get_embedding(self):
+        return np.frombuffer(self.embedding, dtype=np.float32)
+
+class MovieTagRecommendation(models.Model):
+    movie = models.ForeignKey("Movie", on_delete=models.CASCADE, related_name="tag_recommendations")
+    recommended_movies = models.JSONField()
+
+# Bumped by the build commands whenever a strategy's data is rebuilt; used to invalidate caches.
+class StrategyGeneration(models.Model):
+    strategy = models.CharField(max_length=50, unique=True)
+    generation = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+# One row per imported movie information file; import_movies skips files whose
+# modification times match and re-imports the others.
+class MovieImportRecord(models.Model):
+    file_name = models.CharField(max_length=255, unique=True)
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name="import_records")
+    mtime_ns = models.BigIntegerField()
+    poster_mtime_ns = models.BigIntegerField(default=0)
+    content_hash = models.CharField(max_length=64)
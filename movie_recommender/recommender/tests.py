@@ -1,3 +1,989 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import unittest
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from scipy import sparse
+from algorithms.import_changeset import load_changeset, write_changeset
+from algorithms.poster_fetcher import PosterFetcher
+from algorithms import recommendation_cache
+from algorithms.algorithm_plot_topic import clean_docs, load_movies, map_chunks, read_movie_files
+from algorithms.recommendation_cache import (
+    MOVIES_GENERATION, LRUCache, bump_generation, clear_local_cache, get_cache_stats, get_cached_recommendation,
+    set_cached_recommendation,
+)
+from algorithms.title_search import INDEX_TABLE, rebuild_title_index, search_titles, title_index_exists
+from algorithms.neighbor_store import open_neighbor_store, remove_all_neighbor_stores, write_neighbor_store
+from algorithms.similarity import normalize_rows, sparse_top_k_cosine_neighbors, top_k_cosine_neighbors
+from recommender.management.commands import (
+    build_image_recommendations, build_plot_recommendations, import_movies, run_all,
+)
+from recommender import views
+from recommender.models import (
+    Movie, MovieCollaboratorRecommendation, MovieGenreRecommendation, MovieImageEmbedding, MovieImageRecommendation,
+    MovieImportRecord, MoviePlotRecommendation, StrategyGeneration,
+)
+from recommender.management.commands.compute_genre_recommendations import bucketed_genre_neighbors
+
+
+class NeighborStoreTests(TestCase):
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.store_dir)
+        override = override_settings(NEIGHBOR_STORE_DIR=self.store_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_round_trip_pads_short_lists(self):
+        write_neighbor_store("genre", [3, 1], [[1, 2], [3]], [[0.9, 0.5], [0.7]])
+        store = open_neighbor_store("genre")
+        self.assertEqual(store.get(3), [1, 2])
+        self.assertEqual(store.get(1), [3])
+        self.assertEqual(store.get(3, 1), [1])
+        self.assertAlmostEqual(store.get_scores(1)[0], 0.7, places=5)
+        self.assertEqual(store.get(42), [])
+
+    def test_remove_all_neighbor_stores(self):
+        write_neighbor_store("genre", [1], [[2]])
+        write_neighbor_store("tag", [1], [[3]])
+        self.assertEqual(sorted(remove_all_neighbor_stores()), ["genre", "tag"])
+        self.assertIsNone(open_neighbor_store("genre"))
+        self.assertIsNone(open_neighbor_store("tag"))
+
+
+class BuildImageRecommendationsTests(TestCase):
+    top_k = 3
+
+    def setUp(self):
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        override = override_settings(NEIGHBOR_STORE_DIR=store_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.ids = list(range(1, 31))
+        for movie_id in self.ids:
+            Movie.objects.create(
+                movie_id=movie_id, title=f"M{movie_id}", release_year=2000, actors="a", genres="g", directors="d"
+            )
+
+    def embed(self, seed, model_name):
+        vectors = np.random.default_rng(seed).normal(size=(len(self.ids), 8)).astype(np.float32)
+        for movie_id, vector in zip(self.ids, vectors):
+            embedding = MovieImageEmbedding(movie_id=movie_id, poster_hash=f"poster{movie_id}", model_name=model_name)
+            embedding.set_embedding(vector)
+            MovieImageEmbedding.objects.update_or_create(
+                movie_id=movie_id,
+                defaults={"embedding": embedding.embedding, "poster_hash": embedding.poster_hash,
+                          "model_name": model_name},
+            )
+        rows, _ = top_k_cosine_neighbors(vectors, self.top_k)
+        return {movie_id: [self.ids[j] for j in row] for movie_id, row in zip(self.ids, rows)}
+
+    def build(self):
+        stdout = StringIO()
+        with mock.patch("sys.stdout", stdout):
+            call_command("build_image_recommendations", top_k=self.top_k, engine="exact", jobs=1, output="db")
+        return stdout.getvalue()
+
+    def stored(self):
+        return dict(MovieImageRecommendation.objects.values_list("movie_id", "recommended_movies"))
+
+    def test_unchanged_embeddings_recompute_nothing(self):
+        expected = self.embed(0, "model-a")
+        self.build()
+        self.assertEqual(self.stored(), expected)
+        self.assertIn(f"0 of {len(self.ids)} movies need new recommendations", self.build())
+
+    def test_new_model_recomputes_every_movie(self):
+        self.embed(0, "model-a")
+        self.build()
+        # Same posters, new embedding space
+        expected = self.embed(1, "model-b")
+        self.assertIn(f"{len(self.ids)} of {len(self.ids)} movies need new recommendations", self.build())
+        self.assertEqual(self.stored(), expected)
+
+
+class TopKCosineNeighborsTests(SimpleTestCase):
+    def brute_force(self, vectors, top_k):
+        unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        sims = unit @ unit.T
+        np.fill_diagonal(sims, -np.inf)
+        return np.argsort(-sims, axis=1, kind="stable")[:, :top_k], np.sort(sims, axis=1)[:, ::-1][:, :top_k]
+
+    def test_matches_brute_force(self):
+        vectors = np.random.default_rng(3).normal(size=(57, 12))
+        expected_indices, expected_scores = self.brute_force(vectors, 6)
+        for block_size, n_jobs in ((1024, 1), (8, 1), (5, 3)):
+            indices, scores = top_k_cosine_neighbors(vectors, 6, block_size=block_size, n_jobs=n_jobs)
+            np.testing.assert_array_equal(indices, expected_indices)
+            np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+
+    def test_query_indices(self):
+        vectors = np.random.default_rng(4).normal(size=(30, 4))
+        expected_indices, _ = self.brute_force(vectors, 3)
+        indices, _ = top_k_cosine_neighbors(vectors, 3, block_size=4, query_indices=[29, 0, 7])
+        np.testing.assert_array_equal(indices, expected_indices[[29, 0, 7]])
+
+    def test_top_k_larger_than_catalog(self):
+        indices, scores = top_k_cosine_neighbors(np.eye(3), 10)
+        self.assertEqual(indices.shape, (3, 2))
+        self.assertTrue((indices != np.arange(3)[:, None]).all())
+
+
+class SparseTopKCosineNeighborsTests(SimpleTestCase):
+    def test_matches_dense_brute_force(self):
+        rng = np.random.default_rng(5)
+        matrix = sparse.random(80, 40, density=0.05, random_state=5, dtype=np.float32)
+        matrix.data = rng.uniform(0.5, 2.0, size=matrix.nnz).astype(np.float32)
+        dense = matrix.toarray()
+        norms = np.linalg.norm(dense, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        similarity = (dense / norms) @ (dense / norms).T
+
+        top_k = 5
+        for block_size in (4096, 7):
+            indices, scores = sparse_top_k_cosine_neighbors(matrix, top_k, block_size=block_size)
+            self.assertEqual(len(indices), 80)
+            shorter = 0
+            for i in range(80):
+                expected = sorted((j for j in range(80) if j != i and similarity[i, j] > 0),
+                                  key=lambda j: (-similarity[i, j], j))[:top_k]
+                shorter += len(expected) < top_k
+                self.assertEqual(indices[i].tolist(), expected)
+                np.testing.assert_allclose(scores[i], similarity[i, expected], atol=1e-5)
+                self.assertEqual((indices[i].dtype, scores[i].dtype), (np.int32, np.float32))
+            # The fixture has rows with fewer than top_k co-occurring rows, including empty rows
+            self.assertGreater(shorter, 0)
+
+    def test_rows_without_features_have_no_neighbours(self):
+        matrix = sparse.csr_matrix(np.array([[1, 0], [0, 0], [1, 1]], dtype=np.float32))
+        indices, scores = sparse_top_k_cosine_neighbors(matrix, 3)
+        self.assertEqual([row.tolist() for row in indices], [[2], [], [0]])
+        self.assertEqual(len(scores[1]), 0)
+
+
+class BucketedGenreNeighborsTests(SimpleTestCase):
+    def test_ties_broken_by_year_proximity_then_movie_id(self):
+        signatures = [(0, 1), (0, 1), (0, 1), (0, 1), (0,)]
+        years = np.array([2000, 2001, 1999, 2005, 2000])
+        movie_ids = np.array([1, 5, 3, 2, 4])
+        neighbors, scores = bucketed_genre_neighbors(signatures, years, movie_ids, dim=2, top_k=4)
+        # Same signature first (1999 and 2001 are equally close, so the lower ID wins), then (0,)
+        self.assertEqual(neighbors[0], [3, 5, 2, 4])
+        self.assertEqual(scores[0][:3], [1.0, 1.0, 1.0])
+        self.assertAlmostEqual(scores[0][3], 2 ** -0.5, places=5)
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        dim, top_k = 5, 7
+        signatures = [tuple(sorted(set(rng.integers(0, dim, size=rng.integers(1, 4)).tolist()))) for _ in range(60)]
+        years = rng.integers(1990, 2000, size=60)
+        movie_ids = rng.permutation(1000)[:60]
+        neighbors, _ = bucketed_genre_neighbors(signatures, years, movie_ids, dim, top_k)
+
+        vectors = np.zeros((60, dim))
+        for i, signature in enumerate(signatures):
+            vectors[i, list(signature)] = 1.0
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        similarity = np.round(vectors @ vectors.T, 6)
+        for i in range(60):
+            expected = sorted(
+                (j for j in range(60) if j != i),
+                key=lambda j: (-similarity[i, j], abs(years[j] - years[i]), movie_ids[j]),
+            )[:top_k]
+            self.assertEqual(neighbors[i], [int(movie_ids[j]) for j in expected])
+
+
+class FindAffectedTests(SimpleTestCase):
+    top_k = 3
+
+    def neighbors(self, embeddings, ids):
+        rows, _ = top_k_cosine_neighbors(embeddings, self.top_k)
+        return {movie_id: [ids[j] for j in row] for movie_id, row in zip(ids, rows)}
+
+    def test_changed_poster_only_affects_its_neighbours(self):
+        rng = np.random.default_rng(1)
+        centers = rng.normal(size=(4, 16)) * 5
+        embeddings = normalize_rows((np.repeat(centers, 10, axis=0) + rng.normal(size=(40, 16))).astype(np.float32))
+        ids = list(range(100, 140))
+        hashes = [f"h{movie_id}" for movie_id in ids]
+        old = self.neighbors(embeddings, ids)
+        existing = {movie_id: (old[movie_id], poster_hash) for movie_id, poster_hash in zip(ids, hashes)}
+
+        # Movie 105 gets a new poster that moves it from the first to the third cluster
+        new_embeddings = embeddings.copy()
+        new_embeddings[5] = normalize_rows(centers[2:3] + rng.normal(size=(1, 16)))[0]
+        new_hashes = list(hashes)
+        new_hashes[5] = "changed"
+        new = self.neighbors(new_embeddings, ids)
+
+        affected = build_image_recommendations.Command().find_affected(
+            new_embeddings, ids, new_hashes, existing, self.top_k
+        )
+        affected_ids = {movie_id for movie_id, is_affected in zip(ids, affected) if is_affected}
+        genuine = {105} | {m for m in ids if 105 in old[m] or 105 in new[m]}
+        self.assertEqual(affected_ids, genuine)
+        # Every movie whose list really changes is recomputed
+        self.assertTrue({m for m in ids if old[m] != new[m]} <= affected_ids)
+
+    def test_unchanged_catalog_affects_nothing(self):
+        embeddings = normalize_rows(np.random.default_rng(2).normal(size=(20, 8)).astype(np.float32))
+        ids = list(range(20))
+        hashes = [str(movie_id) for movie_id in ids]
+        old = self.neighbors(embeddings, ids)
+        existing = {movie_id: (old[movie_id], poster_hash) for movie_id, poster_hash in zip(ids, hashes)}
+        affected = build_image_recommendations.Command().find_affected(embeddings, ids, hashes, existing, self.top_k)
+        self.assertFalse(affected.any())
+
+
+class FakePosterFetcher:
+    """Stands in for PosterFetcher, returning the given (content, source) per movie."""
+
+    results = {}
+
+    def __init__(self, api_key=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def fetch_all(self, movies):
+        for movie_id, title in movies:
+            yield (movie_id, title) + self.results.get(movie_id, (None, None))
+
+
+class FetchPostersTests(TransactionTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        patcher = mock.patch.object(import_movies, "PosterFetcher", FakePosterFetcher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.fallback_path = os.path.join(self.media_root, "0.png")
+        Image.new("RGB", (2, 3)).save(self.fallback_path)
+        image = BytesIO()
+        Image.new("RGB", (1000, 1500), "red").save(image, format="PNG")
+        FakePosterFetcher.results = {1: (image.getvalue(), "web")}
+
+        for movie_id in (1, 2, 3):
+            Movie.objects.create(
+                movie_id=movie_id, title=f"M{movie_id}", release_year=2000, actors="a", genres="g", directors="d"
+            )
+        self.command = import_movies.Command()
+        self.command.missing_movies = [(1, "M1"), (2, "M2"), (3, "M3")]
+
+    def test_posters_are_resized_and_written(self):
+        self.command.fetch_posters(self.fallback_path, workers=1, batch_size=2)
+        posters = dict(Movie.objects.values_list("movie_id", "poster"))
+        self.assertEqual(posters, {1: "posters/web_1.jpg", 2: "posters/0_2.png", 3: "posters/0_3.png"})
+        with Image.open(os.path.join(self.media_root, posters[1])) as image:
+            self.assertEqual(image.size, import_movies.POSTER_SIZE)
+
+    def test_writer_errors_are_raised(self):
+        with mock.patch.object(Movie.objects, "bulk_update", side_effect=OperationalError("disk I/O error")):
+            with self.assertRaisesMessage(OperationalError, "disk I/O error"):
+                self.command.fetch_posters(self.fallback_path, workers=1, batch_size=1)
+        self.assertFalse(Movie.objects.exclude(poster="").exists())
+
+
+class ImportManifestTests(TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        self.info_dir = os.path.join(self.base_dir, "information")
+        os.makedirs(self.info_dir)
+        os.makedirs(os.path.join(self.base_dir, "posters"))
+        Image.new("RGB", (2, 3)).save(os.path.join(self.base_dir, "posters", "0.png"))
+        override = override_settings(
+            MEDIA_ROOT=os.path.join(self.base_dir, "media"),
+            IMPORT_CHANGESET_PATH=os.path.join(self.base_dir, "changeset.json"),
+            NEIGHBOR_STORE_DIR=os.path.join(self.base_dir, "stores"),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.write_movie(1, "First")
+        self.write_movie(2, "Second")
+
+    def write_movie(self, movie_id, title):
+        path = os.path.join(self.info_dir, f"{movie_id}.json")
+        with open(path, "w") as f:
+            json.dump({
+                "movielens": {"movieId": movie_id, "title": title, "releaseYear": 2000, "genres": ["Drama"]},
+                "tmdb": {"overview": "..."},
+                "imdb": {"actors": ["Stars: A | B"], "directors": ["D"]},
+            }, f)
+        return path
+
+    def set_mtime(self, path, seconds):
+        os.utime(path, ns=(seconds * 10 ** 9, seconds * 10 ** 9))
+
+    def import_movies(self):
+        call_command("import_movies", base_dir=self.base_dir, workers=1, stdout=StringIO())
+        return load_changeset()
+
+    def test_first_import_adds_every_movie(self):
+        changeset = self.import_movies()
+        self.assertEqual(changeset, {"added": [1, 2], "updated": [], "removed": []})
+        self.assertEqual(set(MovieImportRecord.objects.values_list("file_name", flat=True)), {"1.json", "2.json"})
+        self.assertEqual(Movie.objects.get(movie_id=1).poster, "posters/0_1.png")
+
+    def test_unchanged_files_are_skipped(self):
+        self.import_movies()
+        # An unchanged file is not read again, so a database edit survives the re-import
+        Movie.objects.filter(movie_id=1).update(title="Edited")
+        changeset = self.import_movies()
+        self.assertEqual(changeset, {"added": [], "updated": [], "removed": []})
+        self.assertEqual(Movie.objects.get(movie_id=1).title, "Edited")
+
+    def test_touched_file_only_updates_the_manifest(self):
+        self.import_movies()
+        path = os.path.join(self.info_dir, "1.json")
+        self.set_mtime(path, 1000)
+        changeset = self.import_movies()
+        self.assertEqual(changeset["updated"], [])
+        self.assertEqual(MovieImportRecord.objects.get(file_name="1.json").mtime_ns, 1000 * 10 ** 9)
+
+    def test_changed_file_is_reimported(self):
+        self.import_movies()
+        self.set_mtime(self.write_movie(1, "First, revised"), 1000)
+        changeset = self.import_movies()
+        self.assertEqual(changeset, {"added": [], "updated": [1], "removed": []})
+        self.assertEqual(Movie.objects.get(movie_id=1).title, "First, revised")
+
+    def test_changed_movie_id_replaces_the_movie(self):
+        self.import_movies()
+        path = os.path.join(self.info_dir, "2.json")
+        with open(path) as f:
+            data = json.load(f)
+        data["movielens"]["movieId"] = 20
+        with open(path, "w") as f:
+            json.dump(data, f)
+        self.set_mtime(path, 1000)
+        changeset = self.import_movies()
+        self.assertEqual(changeset, {"added": [20], "updated": [], "removed": [2]})
+        self.assertEqual(set(Movie.objects.values_list("movie_id", flat=True)), {1, 20})
+        self.assertEqual(MovieImportRecord.objects.get(file_name="2.json").movie_id, 20)
+
+    def test_removed_file_deletes_the_movie(self):
+        self.import_movies()
+        os.remove(os.path.join(self.info_dir, "2.json"))
+        changeset = self.import_movies()
+        self.assertEqual(changeset, {"added": [], "updated": [], "removed": [2]})
+        self.assertFalse(Movie.objects.filter(movie_id=2).exists())
+        self.assertFalse(MovieImportRecord.objects.filter(file_name="2.json").exists())
+
+
+class FakeStages:
+    """Replaces call_command in run_all's stage processes (which are forked, so they see these values)."""
+
+    failing = set()
+    changeset = {"added": [], "updated": [], "removed": []}
+
+    @classmethod
+    def call_command(cls, command, **kwargs):
+        if command == "import_movies":
+            write_changeset(**cls.changeset)
+        if command in cls.failing:
+            raise RuntimeError(f"{command} failed")
+
+
+class RunAllDirtyStageTests(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.state_path = os.path.join(tmp_dir, "pipeline_state.json")
+        override = override_settings(
+            PIPELINE_STATE_PATH=self.state_path, IMPORT_CHANGESET_PATH=os.path.join(tmp_dir, "changeset.json")
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        patcher = mock.patch.object(run_all, "call_command", FakeStages.call_command)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_pipeline(self, failing=(), added=()):
+        FakeStages.failing = set(failing)
+        FakeStages.changeset = {"added": list(added), "updated": [], "removed": []}
+        call_command("run_all", only=["import", "genre", "tag"], jobs=1, stdout=StringIO(), stderr=StringIO())
+
+    def load_state(self):
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def test_failed_stage_reruns_when_nothing_changed(self):
+        with self.assertRaises(CommandError):
+            self.run_pipeline(failing=["compute_genre_recommendations"], added=[1])
+        self.assertEqual(self.load_state()["dirty"], ["genre"])
+
+        self.run_pipeline()
+        state = self.load_state()
+        self.assertEqual(state["stages"]["genre"]["status"], "ok")
+        self.assertEqual(state["stages"]["tag"]["status"], "unchanged")
+        self.assertEqual(state["dirty"], [])
+
+    def test_clean_stages_are_skipped_when_nothing_changed(self):
+        self.run_pipeline(added=[1])
+        self.run_pipeline()
+        stages = self.load_state()["stages"]
+        self.assertEqual(stages["genre"]["status"], "unchanged")
+        self.assertEqual(stages["tag"]["status"], "unchanged")
+
+
+class StubPosterServer(ThreadingHTTPServer):
+    """Local stand-in for the TMDB API and image host that records every request."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubPosterHandler)
+        self.requests = []
+        self.failures = {}  # path -> list of error statuses returned before succeeding
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubPosterHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        with self.server.lock:
+            self.server.requests.append((time.monotonic(), path))
+            failures = self.server.failures.get(path)
+            status = failures.pop(0) if failures else 200
+        if status != 200:
+            body, content_type = b"", "text/plain"
+        elif path == "/3/search/movie":
+            title = query.rsplit("query=", 1)[-1]
+            body = json.dumps({"results": [{"poster_path": f"/{title}.jpg"}]}).encode()
+            content_type = "application/json"
+        else:
+            body, content_type = f"image {path}".encode(), "image/jpeg"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PosterFetcherTests(SimpleTestCase):
+    def setUp(self):
+        self.server = StubPosterServer()
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        override = override_settings(POSTER_FETCH={
+            "TMDB_API_URL": f"{self.server.url}/3",
+            "TMDB_IMAGE_URL": f"{self.server.url}/img",
+            "CACHE_DIR": self.cache_dir,
+            "RATE_LIMITS": {"default": 0},
+            "RETRIES": 3,
+            "BACKOFF": 0,
+            "TIMEOUT": 5,
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+        # Never fall back to a real web search
+        patcher = mock.patch.object(PosterFetcher, "search_web", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def paths(self):
+        return [path for _, path in self.server.requests]
+
+    def test_retries_server_errors_and_too_many_requests(self):
+        self.server.failures = {"/3/search/movie": [503, 429], "/img/dune.jpg": [500]}
+        with PosterFetcher(api_key="key") as fetcher:
+            content, source = fetcher.fetch(1, "dune")
+        self.assertEqual((content, source), (b"image /img/dune.jpg", "tmdb"))
+        self.assertEqual(self.paths(), ["/3/search/movie"] * 3 + ["/img/dune.jpg"] * 2)
+
+    def test_gives_up_after_the_configured_retries(self):
+        self.server.failures = {"/3/search/movie": [503] * 10}
+        with PosterFetcher(api_key="key", RETRIES=2) as fetcher:
+            self.assertEqual(fetcher.fetch(1, "dune"), (None, None))
+        self.assertEqual(len(self.server.requests), 3)
+        # Failed searches are not cached as "no poster"
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_requests_to_one_host_are_rate_limited(self):
+        with PosterFetcher(api_key="key", RATE_LIMITS={"default": 0.1}, WORKERS=4) as fetcher:
+            results = list(fetcher.fetch_all([(1, "a"), (2, "b"), (3, "c")]))
+        self.assertEqual(sorted(content for _, _, content, _ in results), [
+            b"image /img/a.jpg", b"image /img/b.jpg", b"image /img/c.jpg",
+        ])
+        times = sorted(t for t, _ in self.server.requests)
+        self.assertEqual(len(times), 6)
+        # Arrival times jitter by a few milliseconds, but the spacing adds up over all requests
+        self.assertGreaterEqual(times[-1] - times[0], 0.45)
+
+    def test_retries_wait_for_the_rate_limiter(self):
+        self.server.failures = {"/3/search/movie": [503, 503, 503]}
+        with PosterFetcher(api_key="key", RATE_LIMITS={"default": 0.1}) as fetcher:
+            fetcher.get(f"{self.server.url}/3/search/movie")
+        times = [t for t, _ in self.server.requests]
+        self.assertEqual(len(times), 4)
+        self.assertGreaterEqual(times[-1] - times[0], 0.25)
+
+    def test_cache_hits_make_no_requests(self):
+        with PosterFetcher(api_key="key") as fetcher:
+            first = fetcher.fetch(1, "dune")
+        requests_made = len(self.server.requests)
+        with PosterFetcher(api_key="key") as fetcher:
+            self.assertEqual(fetcher.fetch(1, "dune"), first)
+        self.assertEqual(len(self.server.requests), requests_made)
+
+
+class TitleSearchTests(TestCase):
+    titles = {
+        1: "Star Wars",
+        2: "Star Wars: Episode V - The Empire Strikes Back",
+        3: "Wars of the Stars",
+        4: "Amélie",
+        5: "Starship Troopers",
+        6: "Lone Star",
+    }
+
+    def setUp(self):
+        for movie_id, title in self.titles.items():
+            Movie.objects.create(
+                movie_id=movie_id, title=title, release_year=2000, actors="a", genres="g", directors="d"
+            )
+
+    def ids(self, results):
+        return [movie.movie_id for movie in results.movies]
+
+    def test_index_ranks_prefix_matches(self):
+        self.assertEqual(rebuild_title_index(), len(self.titles))
+        self.assertTrue(title_index_exists())
+        results = search_titles("star wa")
+        self.assertEqual(self.ids(results), [1, 3, 2])
+        self.assertEqual(results.total, 3)
+        # Words match title word prefixes only
+        self.assertEqual(self.ids(search_titles("tar")), [])
+
+    def test_index_ignores_diacritics(self):
+        rebuild_title_index()
+        self.assertEqual(self.ids(search_titles("amelie")), [4])
+        self.assertEqual(self.ids(search_titles("AMÉLIE")), [4])
+
+    def test_pagination_is_clamped(self):
+        rebuild_title_index()
+        results = search_titles("star", page=9, per_page=2)
+        self.assertEqual((results.total, results.page, results.num_pages), (5, 3, 3))
+        self.assertEqual(len(results.movies), 1)
+        self.assertEqual(search_titles("!?"), ([], 0, 1, 1))
+
+    def test_fallback_without_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {INDEX_TABLE}")
+        self.assertFalse(title_index_exists())
+        # Substring matches in alphabetical order; diacritics are not ignored
+        self.assertEqual(self.ids(search_titles("star wa")), [1, 2, 3])
+        self.assertEqual(self.ids(search_titles("tar")), [6, 1, 2, 5, 3])
+        self.assertEqual(self.ids(search_titles("amelie")), [])
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class RecommendationsApiTests(TestCase):
+    def setUp(self):
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        override = override_settings(NEIGHBOR_STORE_DIR=store_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        for movie_id in (1, 2, 3):
+            movie = Movie.objects.create(
+                movie_id=movie_id, title=f"M{movie_id}", release_year=2000, actors="a", genres="g", directors="d"
+            )
+            MovieGenreRecommendation.objects.create(
+                movie=movie, recommended_movies=[m for m in (1, 2, 3) if m != movie_id]
+            )
+        bump_generation("genre", MOVIES_GENERATION)
+        self.url = reverse("api_recommendations")
+
+    def get(self, query, **headers):
+        return self.client.get(f"{self.url}?{query}", **headers)
+
+    def test_batched_recommendations(self):
+        response = self.get("movie_ids=1,3,1,42&strategies=genre&k=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            "k": 1,
+            "strategies": ["genre"],
+            "results": {"1": {"genre": [2]}, "3": {"genre": [1]}, "42": {"genre": []}},
+        })
+        self.assertIn("max-age=60", response["Cache-Control"])
+        self.assertTrue(response.has_header("ETag"))
+        self.assertTrue(response.has_header("Last-Modified"))
+
+    def test_removed_movies_are_not_recommended(self):
+        # Import deletes the movie (and its own row) and the neighbour stores; other lists still name it
+        Movie.objects.filter(movie_id=3).delete()
+        bump_generation(MOVIES_GENERATION)
+        response = self.get("movie_ids=1,2&strategies=genre")
+        self.assertEqual(response.json()["results"], {"1": {"genre": [2]}, "2": {"genre": [1]}})
+
+    def test_invalid_queries(self):
+        for query in (
+            "",
+            "movie_ids=1,x",
+            "movie_ids=1&k=0",
+            f"movie_ids=1&k={views.API_MAX_K + 1}",
+            "movie_ids=" + ",".join(map(str, range(views.API_MAX_MOVIES + 1))),
+            "movie_ids=1&strategies=genre,unknown",
+        ):
+            with self.subTest(query=query):
+                response = self.get(query)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+                self.assertFalse(response.has_header("ETag"))
+
+    def test_query_is_parsed_once(self):
+        with mock.patch.object(
+            views, "parse_recommendation_request", wraps=views.parse_recommendation_request
+        ) as parse:
+            self.get("movie_ids=1&strategies=genre")
+        self.assertEqual(parse.call_count, 1)
+
+    def test_not_modified_until_a_rebuild(self):
+        etag = self.get("movie_ids=1,2&strategies=genre")["ETag"]
+        response = self.get("movie_ids=1,2&strategies=genre", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        bump_generation("genre")
+        response = self.get("movie_ids=1,2&strategies=genre", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_etag_depends_on_the_query(self):
+        etag = self.get("movie_ids=1&strategies=genre&k=5")["ETag"]
+        self.assertNotEqual(self.get("movie_ids=1&strategies=genre&k=4")["ETag"], etag)
+        self.assertNotEqual(self.get("movie_ids=2&strategies=genre&k=5")["ETag"], etag)
+        bump_generation(MOVIES_GENERATION)
+        self.assertNotEqual(self.get("movie_ids=1&strategies=genre&k=5")["ETag"], etag)
+
+    def test_only_get_is_allowed(self):
+        self.assertEqual(self.client.post(f"{self.url}?movie_ids=1").status_code, 405)
+
+
+LOOKUP_IMPORT_CHECK = """
+import os, sys
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "movie_recommender.settings")
+import django
+django.setup()
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+# No neighbour stores, so every lookup goes to the database
+settings.NEIGHBOR_STORE_DIR = sys.argv[1]
+runner = DiscoverRunner(verbosity=0)
+old_config = runner.setup_databases()
+from algorithms.movie_recommender import get_recommendation
+for function_id in (2, 3, 4, 5, 6):
+    get_recommendation(1, 5, function_id)
+runner.teardown_databases(old_config)
+print("heavy:" + ",".join(sorted(name for name in ("gensim", "nltk", "sklearn", "pandas", "annoy") if name in sys.modules)))
+"""
+
+
+class StrategyLookupImportTests(SimpleTestCase):
+    def test_lookups_do_not_import_heavy_libraries(self):
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        result = subprocess.run(
+            [sys.executable, "-c", LOOKUP_IMPORT_CHECK, store_dir],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        )
+        self.assertEqual(result.stdout.strip().splitlines()[-1], "heavy:")
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=2, ttl=60)
+        cache.set("a", [1])
+        cache.set("b", [2])
+        cache.get("a")
+        cache.set("c", [3])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), ([1], [3]))
+        self.assertEqual(len(cache), 2)
+
+    def test_entries_expire(self):
+        cache = LRUCache(max_entries=10, ttl=60)
+        with mock.patch.object(recommendation_cache.time, "monotonic", return_value=1000.0):
+            cache.set("a", [1])
+        with mock.patch.object(recommendation_cache.time, "monotonic", return_value=1059.0):
+            self.assertEqual(cache.get("a"), [1])
+        with mock.patch.object(recommendation_cache.time, "monotonic", return_value=1061.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+class RecommendationCacheTests(TestCase):
+    def setUp(self):
+        clear_local_cache()
+        self.addCleanup(clear_local_cache)
+        caches["default"].clear()
+        self.addCleanup(caches["default"].clear)
+
+    def patch_settings(self, **values):
+        patcher = mock.patch.dict(recommendation_cache._cache_settings, values)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bump_generation_invalidates(self):
+        set_cached_recommendation("genre", 1, 5, [2, 3])
+        self.assertEqual(get_cached_recommendation("genre", 1, 5), [2, 3])
+        self.assertIsNone(get_cached_recommendation("genre", 1, 4))
+        bump_generation("genre")
+        self.assertIsNone(get_cached_recommendation("genre", 1, 5))
+
+    def test_movie_table_generation_invalidates_every_strategy(self):
+        set_cached_recommendation("tag", 1, 5, [2])
+        bump_generation(MOVIES_GENERATION)
+        self.assertIsNone(get_cached_recommendation("tag", 1, 5))
+
+    def test_generations_are_reread_after_their_ttl(self):
+        self.patch_settings(GENERATION_TTL=5)
+        with mock.patch.object(recommendation_cache.time, "monotonic", return_value=1000.0):
+            set_cached_recommendation("genre", 1, 5, [2])
+        # A build in another process bumps the database row without touching this process
+        StrategyGeneration.objects.create(strategy="genre", generation=7)
+        with mock.patch.object(recommendation_cache.time, "monotonic", return_value=1004.0):
+            self.assertEqual(get_cached_recommendation("genre", 1, 5), [2])
+        with mock.patch.object(recommendation_cache.time, "monotonic", return_value=1006.0):
+            self.assertIsNone(get_cached_recommendation("genre", 1, 5))
+
+    def test_shared_cache_alias(self):
+        self.patch_settings(ALIAS="default")
+        set_cached_recommendation("genre", 1, 5, [2])
+        # Another worker starts with an empty LRU
+        clear_local_cache()
+        before = get_cache_stats()
+        self.assertEqual(get_cached_recommendation("genre", 1, 5), [2])
+        self.assertIsNone(get_cached_recommendation("genre", 2, 5))
+        after = get_cache_stats()
+        self.assertEqual(after["shared_hits"] - before["shared_hits"], 1)
+        self.assertEqual(after["shared_misses"] - before["shared_misses"], 1)
+        self.assertEqual(after["local_entries"], 1)
+
+    def test_stats_are_printed_periodically(self):
+        self.patch_settings(STATS_INTERVAL=1)
+        with mock.patch("sys.stdout", new_callable=StringIO) as stdout:
+            get_cached_recommendation("genre", 1, 5)
+        self.assertIn("[INFO] Recommendation cache:", stdout.getvalue())
+        self.assertIn("lookups", stdout.getvalue())
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class DetailedMovieViewTests(TestCase):
+    def setUp(self):
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        override = override_settings(NEIGHBOR_STORE_DIR=store_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        clear_local_cache()
+        for movie_id in range(1, 21):
+            Movie.objects.create(
+                movie_id=movie_id, title=f"M{movie_id}", release_year=2000, actors="a", genres="g", directors="d",
+                poster=f"posters/{movie_id}.jpg",
+            )
+        bump_generation(MOVIES_GENERATION)
+
+    def random_ids(self, response):
+        return [movie.movie_id for movie in response.context["all_recommendations"]["Random"]]
+
+    def test_no_session_without_seed(self):
+        response = self.client.get(reverse("detailed_view", args=[1]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(len(self.random_ids(response)), 5)
+        self.assertNotIn(1, self.random_ids(response))
+
+    def test_seed_makes_random_recommendations_reproducible(self):
+        url = reverse("detailed_view", args=[1]) + "?seed=42"
+        first = self.random_ids(self.client.get(url))
+        self.assertEqual(self.random_ids(self.client.get(url)), first)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.get(url).cookies)
+
+
+class CollaboratorWeightingTests(TestCase):
+    # movie_id: (directors, actors in billing order). Movie 1 shares one collaborator with every other movie:
+    # director D with 3, lead actor A (also in 5 and 6) with 2, second-billed B with 7, third-billed C with 4.
+    movies = {
+        1: ("D", "A, B, C"),
+        2: ("X", "A"),
+        3: ("D", "Y"),
+        4: ("Z", "P, Q, C"),
+        5: ("W", "A"),
+        6: ("V", "A"),
+        7: ("U", "B"),
+    }
+
+    def setUp(self):
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        override = override_settings(NEIGHBOR_STORE_DIR=store_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        for movie_id, (directors, actors) in self.movies.items():
+            Movie.objects.create(
+                movie_id=movie_id, title=f"M{movie_id}", release_year=2000, actors=actors, genres="g",
+                directors=directors,
+            )
+
+    def recommend(self, **options):
+        call_command("compute_collaborator_recommendations", top_k=6, output="db", stdout=StringIO(), **options)
+        return MovieCollaboratorRecommendation.objects.get(movie_id=1).recommended_movies
+
+    def test_binary(self):
+        # One shared collaborator each; only movie 4's longer cast lowers its similarity
+        self.assertEqual(self.recommend(), [2, 3, 5, 6, 7, 4])
+        self.assertEqual(self.recommend(weighting="binary", director_boost=9, billing_decay=0.1), [2, 3, 5, 6, 7, 4])
+
+    def test_idf(self):
+        # A appears in four movies, D, B and C in two
+        self.assertEqual(self.recommend(weighting="idf"), [3, 7, 4, 2, 5, 6])
+
+    def test_idf_billing(self):
+        self.assertEqual(self.recommend(weighting="idf-billing"), [3, 7, 2, 5, 6, 4])
+        # Neutral role weights reduce it to plain idf
+        self.assertEqual(self.recommend(weighting="idf-billing", billing_decay=1.0, director_boost=1.0),
+                         [3, 7, 4, 2, 5, 6])
+
+    def test_director_boost(self):
+        self.assertEqual(self.recommend(weighting="idf-billing", director_boost=0.3), [7, 2, 5, 6, 4, 3])
+
+    def test_billing_decay(self):
+        # A strong decay ranks sharing the lead actor above sharing the second-billed one
+        self.assertEqual(self.recommend(weighting="idf-billing", billing_decay=0.3), [3, 2, 5, 6, 7, 4])
+
+
+class FakeLdaData:
+    """Stands in for LdaData, serving fixed neighbour lists instead of training a model."""
+
+    neighbours = {}
+
+    def __init__(self, data_dir, **kwargs):
+        self.movie_ids = list(self.neighbours)
+        self.movie_id_to_index = {movie_id: i for i, movie_id in enumerate(self.movie_ids)}
+        self.topic_vectors = np.eye(len(self.movie_ids), dtype=np.float32)
+        self.status = "updated"
+
+    def get_recommendations(self, movie_id, top_k, with_scores=False):
+        recommendations = self.neighbours[movie_id][:top_k]
+        return (recommendations, [1.0] * len(recommendations)) if with_scores else recommendations
+
+
+class BuildPlotRecommendationsTests(TestCase):
+    def setUp(self):
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        override = override_settings(NEIGHBOR_STORE_DIR=store_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        patcher = mock.patch.object(build_plot_recommendations, "LdaData", FakeLdaData)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for movie_id in (1, 2, 3, 4):
+            Movie.objects.create(
+                movie_id=movie_id, title=f"M{movie_id}", release_year=2000, actors="a", genres="g", directors="d"
+            )
+
+    def build(self, neighbours):
+        FakeLdaData.neighbours = neighbours
+        call_command("build_plot_recommendations", top_k=2, output="db", stdout=StringIO())
+        return dict(MoviePlotRecommendation.objects.values_list("movie_id", "recommended_movies"))
+
+    def test_existing_rows_follow_the_updated_model(self):
+        self.build({1: [2, 3], 2: [1, 3], 3: [1, 2]})
+        # The model is updated with movie 4, which becomes movie 1's closest neighbour
+        rows = self.build({1: [4, 2], 2: [1, 3], 3: [1, 2], 4: [1, 2]})
+        self.assertEqual(rows, {1: [4, 2], 2: [1, 3], 3: [1, 2], 4: [1, 2]})
+        self.assertEqual(MoviePlotRecommendation.objects.filter(movie_id=1).count(), 1)
+
+    def test_rows_of_movies_without_plot_data_are_removed(self):
+        self.build({1: [2, 3], 2: [1, 3], 3: [1, 2]})
+        rows = self.build({1: [2], 2: [1]})
+        self.assertEqual(rows, {1: [2], 2: [1]})
+
+
+def nltk_data_available():
+    import nltk
+    try:
+        for resource in ("taggers/averaged_perceptron_tagger_eng", "corpora/wordnet"):
+            nltk.data.find(resource)
+    except LookupError:
+        return False
+    return True
+
+
+class PlotPreprocessingParallelTests(SimpleTestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+
+    def write_movies(self, count):
+        for movie_id in range(1, count + 1):
+            movie = {"movieId": movie_id, "title": f"Movie {movie_id}", "plotSummary": f"Plot number {movie_id}."}
+            if movie_id % 7 == 0:
+                del movie["plotSummary"]
+            with open(os.path.join(self.data_dir, f"{movie_id}.json"), "w") as f:
+                json.dump({"movielens": movie}, f)
+
+    def test_map_chunks_keeps_the_serial_order(self):
+        self.write_movies(20)
+        paths = sorted(os.path.join(self.data_dir, name) for name in os.listdir(self.data_dir))
+        serial = map_chunks(read_movie_files, paths, 1, 3, "serial")
+        self.assertEqual(map_chunks(read_movie_files, paths, 2, 3, "parallel"), serial)
+        self.assertEqual(sum(movie is None for movie in serial), 2)
+
+    def test_load_movies_parallel_matches_serial(self):
+        # More files than one 512-file chunk, so the process pool is actually used
+        self.write_movies(1100)
+        with mock.patch("sys.stdout", StringIO()):
+            self.assertEqual(load_movies(self.data_dir, workers=2), load_movies(self.data_dir, workers=1))
+
+    @unittest.skipUnless(nltk_data_available(), "NLTK tagger and WordNet data are not installed")
+    def test_clean_docs_parallel_matches_serial(self):
+        from nltk.stem import WordNetLemmatizer
+
+        texts = [
+            "The cats were running quickly across 3 rooftops!",
+            "A lonely robot builds better robots.",
+            "Wolves hunted; the hunters were hunted.",
+            "Children played games while the geese flew south.",
+            "",
+        ] * 3
+        stop_words = {"the", "a", "were", "while"}
+        serial = clean_docs(texts, stop_words, WordNetLemmatizer(), workers=1)
+        self.assertEqual(clean_docs(texts, stop_words, WordNetLemmatizer(), workers=2, chunk_size=4), serial)
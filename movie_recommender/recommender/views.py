@@ -1,24 +1,48 @@
-from algorithms.movie_recommender import get_recommendation
+from algorithms.movie_recommender import (
+    PRECOMPUTED_STRATEGIES, fetch_precomputed_recommendations, get_all_recommendations,
+)
+from algorithms.recommendation_cache import MOVIES_GENERATION, get_generation_state
+from algorithms.title_search import search_titles
+from django.http import JsonResponse
 from django.shortcuts import render, get_object_or_404
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_GET
 from .models import Movie
+import hashlib
+
+API_MAX_MOVIES = 100
+API_MAX_K = 50
+# Seconds clients and CDNs may reuse a response before revalidating it with its ETag
+API_CACHE_MAX_AGE = 60
 
 # Create your views here.
 def home_view(request):
     query = request.GET.get("q")
     movie_objects = None
+    results = None
     if query:
-        movie_objects = Movie.objects.filter(title__icontains = query)
+        try:
+            page = int(request.GET.get("page", 1))
+        except ValueError:
+            page = 1
+        results = search_titles(query, page)
+        movie_objects = results.movies
     context = {
         "query": query,
-        "movie_objects": movie_objects
+        "movie_objects": movie_objects,
+        "results": results
     }
     return render(request, "home.html", context)
 
 def detailed_movie_view(request, movie_id):
     movie_object = get_object_or_404(Movie, movie_id = movie_id)
     recommendation_amount = 5
+    # An optional ?seed= makes the random recommendations of the page reproducible
+    try:
+        seed = int(request.GET["seed"])
+    except (KeyError, ValueError):
+        seed = None
     
-    all_recommendations = {}
     method_names = {
         1: "Random",
         2: "Image",
@@ -28,13 +52,105 @@ def detailed_movie_view(request, movie_id):
         6: "Title"
     }
     
-    for function_id in range(1, 7):
-        recommended_ids = get_recommendation(movie_id, recommendation_amount, function_id)
-        recommended_movies = Movie.objects.filter(movie_id__in = recommended_ids)
-        all_recommendations[f"{method_names[function_id]}"] = recommended_movies
+    recommendations = get_all_recommendations(movie_id, recommendation_amount, method_names.keys(), seed)
+    all_recommendations = {
+        method_names[function_id]: recommended_movies
+        for function_id, recommended_movies in recommendations.items()
+    }
     
     context = {
         "movie": movie_object,
         "all_recommendations": all_recommendations
     }
-    return render(request, "detailed_view.html", context)
\ No newline at end of file
+    return render(request, "detailed_view.html", context)
+
+def parse_recommendation_request(request):
+    """
+    Validates the query of the recommendations API.
+
+    Returns:
+    tuple: (movie_ids, strategy names, k). Raises ValueError with a message for invalid queries.
+    """
+    try:
+        movie_ids = [int(mid) for mid in request.GET.get("movie_ids", "").split(",") if mid.strip()]
+        k = int(request.GET.get("k", 10))
+    except ValueError:
+        raise ValueError("movie_ids must be a comma separated list of integers and k an integer")
+    if not movie_ids:
+        raise ValueError("movie_ids is required")
+    if len(movie_ids) > API_MAX_MOVIES:
+        raise ValueError(f"At most {API_MAX_MOVIES} movie_ids per request")
+    if not 1 <= k <= API_MAX_K:
+        raise ValueError(f"k must be between 1 and {API_MAX_K}")
+
+    strategies = [name.strip() for name in request.GET.get("strategies", "").split(",") if name.strip()]
+    strategies = strategies or list(PRECOMPUTED_STRATEGIES)
+    unknown = [name for name in strategies if name not in PRECOMPUTED_STRATEGIES]
+    if unknown:
+        raise ValueError(f"Unknown strategies: {', '.join(unknown)} (available: {', '.join(PRECOMPUTED_STRATEGIES)})")
+    return list(dict.fromkeys(movie_ids)), list(dict.fromkeys(strategies)), k
+
+def _recommendation_query(request):
+    # Parsed once per request, shared by the ETag and Last-Modified functions and the view
+    if not hasattr(request, "_recommendation_query"):
+        try:
+            request._recommendation_query = parse_recommendation_request(request)
+        except ValueError as e:
+            request._recommendation_query = e
+    return request._recommendation_query
+
+def _recommendation_generations(request):
+    # Read once per request, shared by the ETag and Last-Modified functions
+    if not hasattr(request, "_recommendation_generations"):
+        query = _recommendation_query(request)
+        if isinstance(query, ValueError):
+            request._recommendation_generations = None
+        else:
+            _, strategies, _ = query
+            request._recommendation_generations = get_generation_state(strategies + [MOVIES_GENERATION])
+    return request._recommendation_generations
+
+def recommendations_etag(request):
+    generations = _recommendation_generations(request)
+    if generations is None:
+        return None
+    movie_ids, strategies, k = _recommendation_query(request)
+    key = "|".join([
+        ",".join(map(str, movie_ids)),
+        ",".join(f"{name}:{generations.get(name, (0, None))[0]}" for name in strategies + [MOVIES_GENERATION]),
+        str(k),
+    ])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def recommendations_last_modified(request):
+    generations = _recommendation_generations(request)
+    if not generations:
+        return None
+    return max(updated_at for _, updated_at in generations.values())
+
+@require_GET
+@condition(etag_func=recommendations_etag, last_modified_func=recommendations_last_modified)
+def recommendations_api_view(request):
+    """
+    JSON recommendations of several movies and strategies in one request, e.g.
+    /api/recommendations?movie_ids=1,2,3&strategies=genre,image&k=10
+
+    The ETag and Last-Modified headers follow the build generations of the requested strategies
+    and of the movie table, so clients and CDNs can revalidate cached responses.
+    """
+    query = _recommendation_query(request)
+    if isinstance(query, ValueError):
+        return JsonResponse({"error": str(query)}, status=400)
+    movie_ids, strategies, k = query
+
+    function_ids = [PRECOMPUTED_STRATEGIES[name] for name in strategies]
+    recommendations = fetch_precomputed_recommendations(movie_ids, function_ids)
+    results = {
+        str(movie_id): {
+            name: recommendations[movie_id][function_id][:k] for name, function_id in zip(strategies, function_ids)
+        }
+        for movie_id in movie_ids
+    }
+    response = JsonResponse({"k": k, "strategies": strategies, "results": results})
+    patch_cache_control(response, public=True, max_age=API_CACHE_MAX_AGE)
+    return response